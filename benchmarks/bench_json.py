@@ -0,0 +1,92 @@
+"""
+    Micro-benchmark of the JSON decoders available to jsonio on payloads
+    shaped like the Github API responses and snapshots the collector handles.
+
+    Run from the repository root with the package installed (or with
+    PYTHONPATH=.): python benchmarks/bench_json.py
+"""
+import json
+import random
+import timeit
+
+from datetime import date, timedelta
+
+from github_traffic_collector import jsonio
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def repo_listing(count=100):
+    # A page of /user/repos: ~100 repositories with a realistic number of fields.
+    repos = []
+    for i in range(count):
+        name = 'repository_{0}'.format(i)
+        repo = dict(('{0}_url'.format(field), 'https://api.github.com/repos/user/{0}/{1}'.format(name, field)) for field in range(40))
+        repo.update({
+            'id': 1000000 + i,
+            'name': name,
+            'full_name': 'user/' + name,
+            'private': bool(i % 2),
+            'description': 'Description of repository number {0}'.format(i) * 3,
+            'stargazers_count': random.randint(0, 5000),
+            'watchers_count': random.randint(0, 500),
+            'owner': {'login': 'user', 'id': 1, 'type': 'User', 'site_admin': False},
+            'permissions': {'admin': True, 'push': True, 'pull': True},
+        })
+        repos.append(repo)
+    return repos
+
+def traffic(key, days=15):
+    start = date.today() - timedelta(days=days)
+    return {
+        'count': 1000,
+        'uniques': 100,
+        key: [
+            {
+                'timestamp': (start + timedelta(days=d)).strftime('%Y-%m-%dT00:00:00Z'),
+                'count': random.randint(0, 200),
+                'uniques': random.randint(0, 50),
+            }
+            for d in range(days)
+        ],
+    }
+
+def referrers():
+    return [
+        {'referrer': 'site{0}.example.com'.format(i), 'count': random.randint(1, 500), 'uniques': random.randint(1, 100)}
+        for i in range(10)
+    ]
+
+def paths():
+    return [
+        {
+            'path': '/user/repository/blob/master/docs/page_{0}.rst'.format(i),
+            'title': 'repository/page_{0}.rst at master · user/repository'.format(i),
+            'count': random.randint(1, 500),
+            'uniques': random.randint(1, 100),
+        }
+        for i in range(10)
+    ]
+
+def bench(name, payload, number):
+    data = json.dumps(payload).encode('utf-8')
+    stdlib = min(timeit.repeat(lambda: json.loads(data.decode('utf-8')), number=number, repeat=5))
+    line = '{0:<16} {1:>8} bytes  json {2:8.2f} us'.format(name, len(data), stdlib / number * 1e6)
+    if orjson is not None:
+        fast = min(timeit.repeat(lambda: orjson.loads(data), number=number, repeat=5))
+        line += '  orjson {0:8.2f} us  speedup {1:5.1f}x'.format(fast / number * 1e6, stdlib / fast)
+    print(line)
+
+def main():
+    random.seed(0)
+    print('jsonio backend: {0}'.format(jsonio.BACKEND))
+    bench('repo listing', repo_listing(), 200)
+    bench('views', traffic('views'), 20000)
+    bench('clones', traffic('clones'), 20000)
+    bench('referrers', referrers(), 20000)
+    bench('paths', paths(), 20000)
+
+if __name__ == '__main__':
+    main()
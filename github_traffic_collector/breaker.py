@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import jsonio
+
+DEFAULT_THRESHOLD = 3
+BASE_COOLDOWN = 24 * 3600
+MAX_COOLDOWN = 7 * 24 * 3600
+
+class CircuitBreaker(object):
+    """
+        Per repository circuit breaker persisted in the datastore.
+
+        After `threshold` consecutive failed collections a repository's
+        circuit opens and it is skipped until the cooldown expires. The next
+        attempt after that is a trial: success closes the circuit, failure
+        re-opens it with the cooldown doubled (up to MAX_COOLDOWN).
+
+        Saving merges the entries changed by this process into the file, so
+        concurrent collectors such as shards can share one breaker file.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.state = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.state = jsonio.load(path)
+
+    def allow(self, repo_name, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return now >= self.state.get(repo_name, {}).get('open_until', 0)
+
+    def open_until(self, repo_name):
+        with self._lock:
+            return self.state.get(repo_name, {}).get('open_until', 0)
+
+    def success(self, repo_name):
+        with self._lock:
+            self.state.pop(repo_name, None)
+            self._changed.add(repo_name)
+
+    def failure(self, repo_name, error, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self.state.setdefault(repo_name, {'failures': 0, 'open_until': 0})
+            entry['failures'] += 1
+            entry['last_error'] = error
+            self._changed.add(repo_name)
+            if entry['failures'] >= self.threshold:
+                trips = entry['failures'] - self.threshold
+                entry['open_until'] = now + min(BASE_COOLDOWN * 2 ** trips, MAX_COOLDOWN)
+
+    def save(self):
+        with self._lock, _locked(self.path + '.lock'):
+            state = jsonio.load(self.path) if os.path.exists(self.path) else {}
+            for repo_name in self._changed:
+                if repo_name in self.state:
+                    state[repo_name] = self.state[repo_name]
+                else:
+                    state.pop(repo_name, None)
+            self._changed.clear()
+            self.state = state
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(jsonio.dumps(state, indent=True))
+            os.replace(tmp_path, self.path)
+
+@contextmanager
+def _locked(path):
+    """
+        Hold an exclusive lock on path across processes where supported.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
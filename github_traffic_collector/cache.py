@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+COLLECTION_STAMP = 'last_collection'
+
+def mark_collection(datastore):
+    """
+        Record that the collector has written new data to the datastore.
+    """
+    path = os.path.join(datastore, COLLECTION_STAMP)
+    with open(path, 'w') as f:
+        f.write(str(time.time()))
+    # Ensure the modification time changes even on coarse timestamp filesystems.
+    os.utime(path, ns=(time.time_ns(), time.time_ns()))
+
+def collection_generation(datastore):
+    """
+        Identifier of the last collection that wrote to the datastore.
+    """
+    try:
+        return os.stat(os.path.join(datastore, COLLECTION_STAMP)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _default_size(value):
+    return 1
+
+class LRUCache(object):
+    """
+        Thread safe least recently used cache bounded by the total size of
+        its values, as measured by the size function.
+    """
+
+    def __init__(self, max_size, size=_default_size):
+        self.max_size = max_size
+        self.size = size
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.size(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.current_size += size
+            while self.current_size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_size -= evicted_size
+
+    def get_or_load(self, key, load):
+        """
+            Read-through lookup: return the cached value or load, cache and
+            return it. Returns (value, hit).
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value, True
+
+        value = load()
+        self.put(key, value)
+        return value, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_size = 0
+
+    def validate(self, generation):
+        """
+            Clear the cache if the data generation has changed.
+        """
+        with self._lock:
+            if generation == self.generation:
+                return
+            self.generation = generation
+            self._entries.clear()
+            self.current_size = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+        Coalesces concurrent calls for the same key into a single call whose
+        result, or exception, is shared with every caller waiting on it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, load):
+        """
+            Return (value, shared), where shared is True if the value came
+            from a call already in flight for another caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = load()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.value, False
@@ -0,0 +1,81 @@
+import glob
+import os
+import threading
+
+from . import jsonio
+
+CHECKPOINT_SUFFIX = '_checkpoint.json'
+
+def checkpoint_path(datastore, date_str):
+    return os.path.join(datastore, 'runs', date_str + CHECKPOINT_SUFFIX)
+
+class Checkpoint(object):
+    """
+        Records which repositories and endpoints of a collection run have
+        completed so an interrupted run can be resumed.
+    """
+
+    def __init__(self, path, date_str, completed=None, finished=False):
+        self.path = path
+        self.date_str = date_str
+        self.completed = dict(
+            (repo, set(endpoints)) for repo, endpoints in (completed or {}).items()
+        )
+        self.finished = finished
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, datastore, date_str):
+        checkpoint = cls(checkpoint_path(datastore, date_str), date_str)
+        checkpoint.save()
+
+        return checkpoint
+
+    @classmethod
+    def load(cls, path):
+        data = jsonio.load(path)
+
+        return cls(path, data['date_str'], data['completed'], data['finished'])
+
+    @classmethod
+    def latest_unfinished(cls, datastore):
+        """
+            Return the most recent checkpoint of a run that did not finish,
+            or None if the latest run completed.
+        """
+        pattern = os.path.join(datastore, 'runs', '*' + CHECKPOINT_SUFFIX)
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            return None
+
+        checkpoint = cls.load(paths[-1])
+        if checkpoint.finished:
+            return None
+
+        return checkpoint
+
+    def is_done(self, repo_name, endpoint):
+        with self._lock:
+            return endpoint in self.completed.get(repo_name, ())
+
+    def mark(self, repo_name, endpoint):
+        with self._lock:
+            self.completed.setdefault(repo_name, set()).add(endpoint)
+
+    def finish(self):
+        self.finished = True
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            data = {
+                'date_str': self.date_str,
+                'finished': self.finished,
+                'completed': dict(
+                    (repo, sorted(endpoints)) for repo, endpoints in self.completed.items()
+                ),
+            }
+        tmp_path = self.path + '.tmp'
+        jsonio.dump(data, tmp_path)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,62 @@
+"""
+    HTTP content encoding of text responses, using brotli when it is
+    installed and gzip otherwise.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Supported encodings in order of preference.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'application/json', 'image/svg+xml')
+
+# Bodies smaller than this aren't worth the encoding overhead.
+MIN_SIZE = 512
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+def accepted_encodings(header):
+    """
+        Parse an Accept-Encoding header into a dict of coding to q-value.
+    """
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    return accepted
+
+def negotiate(header, encodings = ENCODINGS):
+    """
+        The preferred encoding of those given that the client accepts, or
+        None for an unencoded response.
+    """
+    accepted = accepted_encodings(header or '')
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality = BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel = GZIP_LEVEL)
+    raise ValueError("Unsupported encoding: {0}".format(encoding))
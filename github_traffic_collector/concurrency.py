@@ -0,0 +1,86 @@
+import threading
+import time
+
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_INITIAL_CONCURRENCY = 2
+
+# Status codes Github always uses for rate limiting. Github also uses 403 for
+# rate limiting, but for permission errors too, so callers flag throttled 403s.
+BACKOFF_STATUSES = (429,)
+
+class AdaptiveLimiter(object):
+    """
+        Limits the number of requests in flight, adjusting the limit with
+        additive increase, multiplicative decrease (AIMD).
+
+        The limit grows by roughly one per round of successful requests while
+        latency stays close to its long term average, and is halved on rate
+        limit or server error responses, or when latency rises sharply.
+    """
+
+    def __init__(self, minimum=DEFAULT_MIN_CONCURRENCY, maximum=DEFAULT_MAX_CONCURRENCY,
+                 initial=DEFAULT_INITIAL_CONCURRENCY, latency_factor=2.0, alpha=0.05):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_factor = latency_factor
+        self.alpha = alpha
+        self.average_latency = None
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.history = [self.limit]
+        self.decreases = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, status=None, throttled=False):
+        """
+            Release a slot, feeding back the request latency, response status
+            (None if the request raised) and whether the response said the
+            request was rate limited.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            unhealthy = status is None or throttled or status in BACKOFF_STATUSES or status >= 500
+            slow = (
+                self.average_latency is not None
+                and latency > self.latency_factor * self.average_latency
+            )
+
+            if unhealthy or slow:
+                # Only back off once per round trip so a burst of failures from
+                # the same window doesn't collapse the limit to the minimum.
+                now = time.monotonic()
+                if now - self.last_decrease > (self.average_latency or latency):
+                    self.limit = max(self.minimum, self.limit / 2.0)
+                    self.last_decrease = now
+                    self.decreases += 1
+                    self.history.append(self.limit)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self.history.append(self.limit)
+
+            if not unhealthy:
+                if self.average_latency is None:
+                    self.average_latency = latency
+                else:
+                    self.average_latency += self.alpha * (latency - self.average_latency)
+
+            self._condition.notify_all()
+
+    def report(self):
+        with self._condition:
+            return {
+                'final': int(self.limit),
+                'min': int(min(self.history)),
+                'max': int(max(self.history)),
+                'mean': sum(self.history) / len(self.history),
+                'decreases': self.decreases,
+                'average_latency': self.average_latency,
+            }
@@ -0,0 +1,82 @@
+import os
+import zlib
+
+from . import jsonio
+
+TRAFFIC_WINDOW = 14 * 24 * 3600
+DEFAULT_INTERVAL = 24 * 3600
+RETRY_DELAY = 15 * 60
+
+class Schedule(object):
+    """
+        Spreads collection of each repository evenly across a fixed interval.
+
+        Every repository is given a stable slot within the interval derived
+        from a hash of its name. A repository is due at the first slot after
+        its last collection, so each one is collected once per interval, and
+        repositories missed while the daemon was down are due immediately.
+        Repositories never collected are due at the first slot after they
+        were first seen.
+        Keeping the interval well inside Github's 14 day traffic window
+        guarantees no traffic data is lost between collections.
+    """
+
+    def __init__(self, state_path, interval=DEFAULT_INTERVAL):
+        if interval >= TRAFFIC_WINDOW / 2:
+            raise ValueError(
+                "Collection interval must be less than half the {0} day traffic window".format(
+                    TRAFFIC_WINDOW // (24 * 3600)
+                )
+            )
+
+        self.state_path = state_path
+        self.interval = interval
+        self.last_collected = {}
+        self.first_seen = {}
+        self.retry_at = {}
+        if os.path.exists(state_path):
+            state = jsonio.load(state_path)
+            self.last_collected = state['last_collected']
+            self.first_seen = state.get('first_seen', {})
+
+    def slot(self, repo_name):
+        return zlib.crc32(repo_name.encode('utf-8')) % self.interval
+
+    def due(self, repo_name, now):
+        if repo_name in self.retry_at:
+            return self.retry_at[repo_name]
+
+        offset = self.slot(repo_name)
+        last = self.last_collected.get(repo_name)
+        if last is None:
+            # Never collected, due at the first slot after it was first seen.
+            last = self.first_seen.setdefault(repo_name, now)
+
+        previous_slot = last - (last - offset) % self.interval
+
+        return previous_slot + self.interval
+
+    def next_due(self, repo_names, now):
+        """
+            Return the (due time, repository) pair that is due soonest.
+        """
+        seen = len(self.first_seen)
+        due = min((self.due(name, now), name) for name in repo_names)
+        if len(self.first_seen) != seen:
+            self.save()
+
+        return due
+
+    def collected(self, repo_name, when):
+        self.retry_at.pop(repo_name, None)
+        self.first_seen.pop(repo_name, None)
+        self.last_collected[repo_name] = when
+        self.save()
+
+    def failed(self, repo_name, when):
+        self.retry_at[repo_name] = when + RETRY_DELAY
+
+    def save(self):
+        tmp_path = self.state_path + '.tmp'
+        jsonio.dump({'last_collected': self.last_collected, 'first_seen': self.first_seen}, tmp_path)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,54 @@
+"""
+    Shape preserving downsampling of timeseries for plotting.
+"""
+import numpy as np
+
+def lttb_indices(y, threshold):
+    """
+        Indices of the points selected by the Largest-Triangle-Three-Buckets
+        algorithm (Steinarsson, 2013) to represent y with threshold points.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Treat gaps as zero so they don't poison the triangle areas.
+    y = np.where(np.isnan(y), 0.0, y)
+
+    # Bucket boundaries for the points between the fixed first and last.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+def downsample(ts, threshold):
+    """
+        Downsample a Series to at most threshold points with LTTB.
+    """
+    if len(ts) <= threshold:
+        return ts
+
+    return ts.iloc[lttb_indices(ts.values, threshold)]
+
+def pixel_width(fig):
+    return int(fig.get_figwidth() * fig.dpi)
@@ -0,0 +1,208 @@
+"""
+    Export of the gtc-server dashboard as a static site.
+
+    Pages and plots are produced by requesting the server's own routes through
+    the Flask test client, so the export matches what the server shows.
+    Internal links are rewritten to relative links between the exported
+    files.
+"""
+import argparse
+import os
+import posixpath
+import re
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from . import jsonio
+from . import server
+from .render import MEASURAND_NAME, write_file
+from .snapshot_index import index_path
+from .snapshots import find_snapshot
+from .tsfile import map_records
+
+STATE_NAME = '.export_state.json'
+
+# File extensions of exported routes by first path segment, pages otherwise.
+EXTENSIONS = {
+    'plot': '.png',
+    'sparkline': '.svg',
+}
+
+LINK = re.compile(r'(src|href)="(/[^"]*)"')
+
+def export_path(url):
+    """
+        Path of the exported file for a server URL, relative to the site root.
+    """
+    path = url.strip('/')
+    if not path:
+        return 'index.html'
+
+    return path + EXTENSIONS.get(path.split('/', 1)[0], '.html')
+
+def relative_links(html, url):
+    """
+        Rewrite the absolute internal links of a page to relative links
+        between exported files.
+    """
+    base = posixpath.dirname(export_path(url))
+
+    def rewrite(match):
+        return '{0}="{1}"'.format(match.group(1), posixpath.relpath(export_path(match.group(2)), base or '.'))
+
+    return LINK.sub(rewrite, html)
+
+def _init_worker(datastore, thumbnails):
+    server.configure(datastore, thumbnails)
+
+def export_url(task):
+    """
+        Request one URL from the server and write the response into the site.
+    """
+    output, url = task
+    response = server.app.test_client().get(url)
+    if response.status_code != 200:
+        raise RuntimeError("{0} returned {1}".format(url, response.status_code))
+
+    content = response.get_data()
+    if response.mimetype == 'text/html':
+        content = relative_links(content.decode('utf-8'), url)
+    write_file(os.path.join(output, *export_path(url).split('/')), content)
+
+    return url
+
+def measurand_members(db):
+    """
+        The repositories with a timeseries of each measurand. Repositories
+        whose collection failed part way through may lack some measurands.
+    """
+    return dict((measurand, set(db.ts_list(measurand = measurand))) for measurand in MEASURAND_NAME)
+
+def repository_measurands(members, ts_id):
+    return [measurand for measurand in MEASURAND_NAME if ts_id in members[measurand]]
+
+def repository_signature(db, datastore, ts_id, measurands):
+    """
+        Summary of the data behind a repository's pages: the size and
+        modification time of each timeseries file and the latest snapshots.
+    """
+    series = {}
+    for measurand in measurands:
+        path = db.get_file_path(ts_id, 'D', measurand = measurand)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            series[measurand] = [stat.st_size, stat.st_mtime_ns]
+
+    data_dir = os.path.join(datastore, *ts_id.split('/'))
+    snapshots = [find_snapshot(data_dir, os.path.join('*', '*', ''), kind) for kind in ('referrer', 'path')]
+
+    return {'series': series, 'snapshots': snapshots}
+
+def repository_urls(db, ts_id, measurands, thumbnails):
+    """
+        URLs linked from the summary and repository pages for a repository.
+    """
+    urls = ['/repo/' + ts_id]
+    for measurand in measurands:
+        if len(map_records(db.get_file_path(ts_id, 'D', measurand = measurand))) > 0:
+            urls.append(server.THUMBNAIL_ROUTES[thumbnails].format(measurand, ts_id))
+            if measurand == 'UV':
+                urls.append('/plot/UV/' + ts_id)
+
+    return urls
+
+def remove_repository(output, ts_id):
+    for measurand in MEASURAND_NAME:
+        for url in ('/plot/{0}/{1}', '/sparkline/{0}/{1}'):
+            path = os.path.join(output, *export_path(url.format(measurand, ts_id)).split('/'))
+            if os.path.exists(path):
+                os.remove(path)
+    path = os.path.join(output, *export_path('/repo/' + ts_id).split('/'))
+    if os.path.exists(path):
+        os.remove(path)
+
+def export_site(datastore, output, processes = None, thumbnails = server.THUMBNAIL_RENDERER, full = False):
+    """
+        Export the dashboard of a datastore into the output directory,
+        rendering in parallel. Repositories whose data is unchanged since the
+        last export are skipped unless full is set.
+    """
+    server.configure(datastore, thumbnails)
+    db = server.db
+    os.makedirs(output, exist_ok = True)
+
+    state_path = os.path.join(output, STATE_NAME)
+    state = {'thumbnails': None, 'repos': {}}
+    if not full and os.path.exists(state_path):
+        state = jsonio.load(state_path)
+    if state['thumbnails'] != thumbnails:
+        state['repos'] = {}
+
+    members = measurand_members(db)
+    signatures = dict(
+        (ts_id, repository_signature(db, datastore, ts_id, repository_measurands(members, ts_id)))
+        for ts_id in db.list_ids()
+    )
+    changed = [ts_id for ts_id, signature in signatures.items() if state['repos'].get(ts_id) != signature]
+    removed = [ts_id for ts_id in state['repos'] if ts_id not in signatures]
+    index_stamp = os.stat(index_path(datastore)).st_mtime_ns if os.path.exists(index_path(datastore)) else None
+
+    if not changed and not removed and state.get('index') == index_stamp and state.get('complete'):
+        LOGGER.info("Nothing has changed since the last export")
+        return 0, 0
+
+    for ts_id in removed:
+        remove_repository(output, ts_id)
+
+    # The index, summaries and cross repository plots depend on every
+    # repository, so are exported whenever anything changed.
+    urls = ['/', '/plot/top/referrer', '/plot/top/path']
+    for measurand in MEASURAND_NAME:
+        urls.append('/summary/' + measurand)
+        urls.append('/plot/top_ten/' + measurand)
+    for ts_id in changed:
+        urls.extend(repository_urls(db, ts_id, repository_measurands(members, ts_id), thumbnails))
+    LOGGER.info("Exporting %d files for %d changed repositories (%d unchanged)",
+        len(urls), len(changed), len(signatures) - len(changed))
+
+    exported = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers = processes, initializer = _init_worker, initargs = (datastore, thumbnails)) as executor:
+        futures = dict((executor.submit(export_url, (output, url)), url) for url in sorted(set(urls)))
+        for future in as_completed(futures):
+            try:
+                future.result()
+                exported += 1
+            except Exception as e:
+                LOGGER.warning("Failed to export %s: %s", futures[future], e)
+                failed.append(futures[future])
+
+    # Repositories with failures are retried by the next export.
+    for ts_id in changed:
+        if any(url.endswith('/' + ts_id) for url in failed):
+            signatures.pop(ts_id)
+    state = {'thumbnails': thumbnails, 'repos': signatures, 'index': index_stamp, 'complete': not failed}
+    jsonio.dump(state, state_path + '.tmp', indent = True)
+    os.replace(state_path + '.tmp', state_path)
+    LOGGER.info("Exported %d files, %d failed", exported, len(failed))
+
+    return exported, len(failed)
+
+def export_main(argv):
+    parser = argparse.ArgumentParser(prog='gtc-server export', description='Export the dashboard as a static site.')
+    parser.add_argument('datastore', help="Location of datastore to visualise")
+    parser.add_argument('output', help="Directory to write the site to")
+    parser.add_argument('--processes', type=int, help="Number of rendering processes (default: number of CPUs).")
+    parser.add_argument('--thumbnails', choices = sorted(server.THUMBNAIL_ROUTES), default = server.THUMBNAIL_RENDERER,
+        help="Renderer for summary page thumbnails (default: %(default)s)")
+    parser.add_argument('--full', action='store_true', help="Re-export every repository, not only those that changed.")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig()
+    LOGGER.setLevel(logging.DEBUG if args.debug else logging.INFO)
+
+    export_site(args.datastore, args.output, args.processes, args.thumbnails, args.full)
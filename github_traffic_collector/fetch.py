@@ -0,0 +1,200 @@
+import gzip
+import requests
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from .concurrency import AdaptiveLimiter
+from .jsonio import response_json
+from .timing import percentile
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Number of samples of an endpoint needed before hedging it on its p95.
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 95
+
+class FetchError(Exception):
+    """
+        Raised when a Github API request returns an error status.
+    """
+
+    def __init__(self, endpoint, url, status, message, throttled=False):
+        super(FetchError, self).__init__(
+            "{0} request to {1} failed with status {2}: {3}".format(endpoint, url, status, message)
+        )
+        self.endpoint = endpoint
+        self.url = url
+        self.status = status
+        self.message = message
+        self.throttled = throttled
+
+def _error_message(r):
+    try:
+        body = response_json(r)
+    except ValueError:
+        return r.reason
+
+    return body.get('message', r.reason) if isinstance(body, dict) else r.reason
+
+def throttled(r):
+    """
+        Whether a response says Github rate limited the request. Github
+        answers 403 both for rate limits and for permanent permission errors
+        (e.g. traffic endpoints without push access), so a 403 only counts
+        when its headers or message say it is a rate limit.
+    """
+    if r.status_code == 429:
+        return True
+    if r.status_code != 403:
+        return False
+    if r.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in r.headers:
+        return True
+
+    return 'rate limit' in _error_message(r).lower()
+
+def read_body(r):
+    """
+        Read the body of a streamed response, returning the decoded content
+        and, when the server gzip encoded it, the body as received.
+    """
+    if r.headers.get('Content-Encoding', '').lower() == 'gzip':
+        gzipped = r.raw.read(decode_content = False)
+        return gzip.decompress(gzipped), gzipped
+
+    return r.content, None
+
+class Fetcher(object):
+    """
+        Issues Github API requests over a shared connection pool, timing each
+        request against the endpoint it belongs to and spreading requests
+        across the tokens in the token pool.
+
+        The number of requests in flight across threads is governed by an
+        adaptive limiter. Every request has a connect/read timeout and is
+        retried with exponential backoff on connection errors, timeouts and
+        retryable statuses. With hedging enabled, a request still outstanding
+        after the endpoint's observed p95 latency is duplicated and the first
+        response wins. Error statuses remaining after retries raise FetchError.
+    """
+
+    def __init__(self, timer, tokens, params, session=None, limiter=None,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 retries=DEFAULT_RETRIES, hedge=False):
+        self.timer = timer
+        self.tokens = tokens
+        self.params = params
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize = self.limiter.maximum * 2)
+            session.mount('https://', adapter)
+        self.session = session
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.retried = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._hedge_executor = ThreadPoolExecutor(max_workers = self.limiter.maximum * 2) if hedge else None
+
+    def get(self, endpoint, url, repo_name=None, token=None, params=None, **kwargs):
+        if params is None:
+            params = self.params
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            request_token = token if token is not None else self.tokens.pick(repo_name)
+            try:
+                if self.hedge:
+                    r = self._hedged_request(endpoint, url, request_token, params, kwargs)
+                else:
+                    r = self._request(endpoint, url, request_token, params, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                LOGGER.warning("Retrying %s after error: %s", url, e)
+                delay = 2 ** attempt
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    if r.status_code >= 400:
+                        message = _error_message(r)
+                        r.close()
+                        raise FetchError(endpoint, url, r.status_code, message, throttled(r))
+                    return r
+                LOGGER.warning("Retrying %s after status %d", url, r.status_code)
+                delay = float(r.headers.get('Retry-After', 2 ** attempt))
+                r.close()
+
+            attempt += 1
+            self.retried += 1
+            time.sleep(delay)
+
+    def _request(self, endpoint, url, token, params, kwargs):
+        headers = { 'Authorization': "token {0}".format(token.value) }
+        self.limiter.acquire()
+        status = None
+        is_throttled = False
+        start = time.perf_counter()
+        try:
+            r = self.session.get(url, headers = headers, params = params, **kwargs)
+            status = r.status_code
+            is_throttled = throttled(r)
+        finally:
+            duration = time.perf_counter() - start
+            self.limiter.release(duration, status, is_throttled)
+            self.timer.record_endpoint(endpoint, duration)
+        LOGGER.debug(r.url)
+        self.tokens.update(token, r)
+
+        return r
+
+    def _hedge_delay(self, endpoint):
+        samples = list(self.timer.endpoints.get(endpoint, []))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+
+        return percentile(samples, HEDGE_PERCENTILE)
+
+    def _hedged_request(self, endpoint, url, token, params, kwargs):
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            return self._request(endpoint, url, token, params, kwargs)
+
+        primary = self._hedge_executor.submit(self._request, endpoint, url, token, params, kwargs)
+        done, _ = wait([primary], timeout = delay)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        LOGGER.debug("Hedging slow request to %s", url)
+        hedge = self._hedge_executor.submit(self._request, endpoint, url, token, params, kwargs)
+
+        for future in as_completed([primary, hedge]):
+            if future.exception() is None:
+                if future is hedge:
+                    self.hedge_wins += 1
+                loser = primary if future is hedge else hedge
+                loser.add_done_callback(_close_response)
+                return future.result()
+
+        # Both requests failed, surface the original error.
+        return primary.result()
+
+    def report(self):
+        return {
+            'retries': self.retried,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+        }
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
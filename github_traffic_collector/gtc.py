@@ -1,8 +1,10 @@
 import argparse
+import functools
 import os
 import pandas as pd
-import requests
 import shutil
+import sys
+import time
 import yaml
 
 import logging
@@ -11,14 +13,69 @@ LOGGER = logging.getLogger(__name__)
 from datetime import datetime
 from phildb.create import create
 from phildb.database import PhilDB
-from phildb.exceptions import DuplicateError
+from phildb.exceptions import DuplicateError, MissingDataError
 from prompt_toolkit import prompt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .breaker import DEFAULT_THRESHOLD, CircuitBreaker
+from .cache import mark_collection
+from .checkpoint import Checkpoint
+from .concurrency import AdaptiveLimiter
+from .daemon import DEFAULT_INTERVAL, RETRY_DELAY, Schedule
+from .fetch import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, RETRY_STATUSES, FetchError, Fetcher, read_body
+from .jsonio import response_json
+from .shard import in_shard, move_snapshots, parse_shard, staged_datastores, staging_path
+from .snapshot_index import SnapshotIndex, import_snapshots, index_path
+from .snapshots import SnapshotStore, SnapshotWriter
+from .timing import Progress, RunTimer
+from .tokens import TokenPool
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
 GITHUB_API_HOST = 'https://api.github.com'
 
+REPOS_URL = GITHUB_API_HOST + '/user/repos'
+VIEWS_URL = GITHUB_API_HOST + "/repos/{0}/traffic/views"
+CLONES_URL = GITHUB_API_HOST + "/repos/{0}/traffic/clones"
+REFERRERS_URL = GITHUB_API_HOST + "/repos/{0}/traffic/popular/referrers"
+PATHS_URL = GITHUB_API_HOST + "/repos/{0}/traffic/popular/paths"
+REPO_INFO_URL = GITHUB_API_HOST + "/repos/{0}"
+
+DATE_FORMAT = '%Y%m%d_%H%M'
+
+def is_transient(exception):
+    """
+        Whether a failure may succeed when retried, as opposed to a permanent
+        error such as a 403 for missing push access.
+    """
+    if isinstance(exception, FetchError):
+        return exception.throttled or exception.status in RETRY_STATUSES or exception.status >= 500
+
+    return True
+
+def failure_details(repo_name, exception):
+    details = {
+        'repo': repo_name,
+        'error': type(exception).__name__,
+        'message': str(exception),
+        'transient': is_transient(exception),
+    }
+    if isinstance(exception, FetchError):
+        details['endpoint'] = exception.endpoint
+        details['status'] = exception.status
+
+    return details
+
+MEASURANDS = (
+    ('C', 'CLONES', 'Total number of git clones'),
+    ('UC', 'UNIQUE_CLONES', 'Number of unique git clones'),
+    ('V', 'VIEWS', 'Total number of views'),
+    ('UV', 'UNIQUE_VIEWS', 'Number of unique views'),
+    ('S', 'STARGAZERS', 'Number of repository stars'),
+    ('W', 'WATCHERS', 'Number of repository watchers'),
+)
+
 def __get_page_links(request):
     links = {}
     if 'Link' in request.headers:
@@ -31,25 +88,98 @@ def __get_page_links(request):
     return links
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Github traffic collector.')
+
+def __setup_logging(debug):
+    logging.basicConfig()
+    LOGGER.setLevel(logging.INFO)
+    if debug:
+        LOGGER.setLevel(logging.DEBUG)
+
+def daemon_main(argv):
+    parser = argparse.ArgumentParser(prog='gtc daemon', description='Run the Github traffic collector as a long running daemon.')
+    parser.add_argument('datastore', help="Location to store data including a PhilDB database")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL / 3600.0, help="Hours over which collection of all repositories is spread (default: %(default)s).")
+    parser.add_argument('--listing-refresh', type=float, default=6, help="Hours between refreshes of the repository listing (default: %(default)s).")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+
+    args = parser.parse_args(argv)
+    __setup_logging(args.debug)
+
+    run_daemon(args.datastore, interval = int(args.interval * 3600), listing_refresh = int(args.listing_refresh * 3600))
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog='gtc merge', description='Merge sharded staging areas into the main datastore.')
+    parser.add_argument('datastore', help="Location of the main datastore")
+    parser.add_argument('staging', nargs='*', help="Staging areas to merge (default: all under <datastore>/staging)")
+    parser.add_argument('--keep-staging', action='store_true', help="Do not remove staging areas after merging.")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+
+    args = parser.parse_args(argv)
+    __setup_logging(args.debug)
+
+    merge_staging(args.datastore, args.staging or None, keep_staging = args.keep_staging)
+
+def import_main(argv):
+    parser = argparse.ArgumentParser(prog='gtc import-snapshots', description='Import existing referrer and path snapshots into the snapshot index.')
+    parser.add_argument('datastore', help="Location of the datastore")
+    parser.add_argument('--processes', type=int, help="Number of parser processes (default: number of CPUs).")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+
+    args = parser.parse_args(argv)
+    __setup_logging(args.debug)
+
+    imported, failed = import_snapshots(args.datastore, args.processes)
+    LOGGER.info("Imported %d snapshots, %d failed", imported, failed)
+
+def render_main(argv):
+    parser = argparse.ArgumentParser(prog='gtc render', description='Pre-render the dashboard plots into the datastore for gtc-server to serve.')
+    parser.add_argument('datastore', help="Location of the datastore")
+    parser.add_argument('--processes', type=int, help="Number of rendering processes (default: number of CPUs).")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+
+    args = parser.parse_args(argv)
+    __setup_logging(args.debug)
+
+    # Imported here so collection runs don't load Matplotlib.
+    from .render import render_datastore
+    render_datastore(args.datastore, open_database(args.datastore), args.processes)
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(
+        description='Github traffic collector.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=COMMANDS_HELP
+    )
     parser.add_argument('datastore', help="Location to store data including a PhilDB database", nargs='?')
     parser.add_argument('--debug', action='store_true', help="Enable debug logging information.")
+    parser.add_argument('--progress', action='store_true', help="Show a live progress line with throughput and ETA.")
+    parser.add_argument('--resume', action='store_true', help="Resume the last interrupted run, fetching only what it did not complete.")
+    parser.add_argument('--shard', type=parse_shard, help="Collect only shard K of N (given as K/N) of the repositories into a staging area of the datastore.")
+    parser.add_argument('--config', help="Configuration file to use instead of the datastore's config.yaml (e.g. with a token for this shard).")
+    parser.add_argument('--render', action='store_true', help="Pre-render the dashboard plots after collecting (ignored with --shard, render after merging instead).")
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    __setup_logging(args.debug)
 
-    logging.basicConfig()
-    LOGGER.setLevel(logging.INFO)
-    if args.debug:
-        LOGGER.setLevel(logging.DEBUG)
+    collect_traffic_data(
+        args.datastore, progress = args.progress, resume = args.resume,
+        shard = args.shard, config_path = args.config
+    )
 
-    collect_traffic_data(args.datastore)
+    if args.render and args.shard is None:
+        from .render import render_datastore
+        render_datastore(args.datastore, open_database(args.datastore))
 
 
-def collect_traffic_data(datastore):
-    if not os.path.exists(datastore):
-        os.mkdir(datastore)
+def open_database(datastore):
+    os.makedirs(datastore, exist_ok=True)
 
     db_path = os.path.join(datastore, 'gtc_phildb')
     if not os.path.exists(db_path):
@@ -61,37 +191,17 @@ def collect_traffic_data(datastore):
     else:
         db = PhilDB(db_path)
 
-    try:
-        db.add_measurand('C', 'CLONES', 'Total number of git clones')
-    except DuplicateError:
-        pass
-
-    try:
-        db.add_measurand('UC', 'UNIQUE_CLONES', 'Number of unique git clones')
-    except DuplicateError:
-        pass
-
-    try:
-        db.add_measurand('V', 'VIEWS', 'Total number of views')
-    except DuplicateError:
-        pass
-
-    try:
-        db.add_measurand('UV', 'UNIQUE_VIEWS', 'Number of unique views')
-    except DuplicateError:
-        pass
-
-    try:
-        db.add_measurand('S', 'STARGAZERS', 'Number of repository stars')
-    except DuplicateError:
-        pass
+    for measurand, long_id, description in MEASURANDS:
+        try:
+            db.add_measurand(measurand, long_id, description)
+        except DuplicateError:
+            pass
 
-    try:
-        db.add_measurand('W', 'WATCHERS', 'Number of repository watchers')
-    except DuplicateError:
-        pass
+    return db
 
-    config_path = os.path.join(datastore, 'config.yaml')
+def load_config(datastore, config_path = None):
+    if config_path is None:
+        config_path = os.path.join(datastore, 'config.yaml')
     if not os.path.exists(config_path):
         access_token = prompt('Enter Github API personal access token to use for authentication: ')
         config = {
@@ -104,57 +214,126 @@ def collect_traffic_data(datastore):
         with open(config_path, 'r') as c:
             config = yaml.safe_load(c)
 
-    headers = { 'Authorization': "token {0}".format(config['access_token']) }
+    return config
+
+def new_fetcher(timer, config):
     params = {'per_page': 100}
 
     if 'repo_type' in config:
         params['type'] = config['repo_type']
 
-    repos_url = GITHUB_API_HOST + '/user/repos'
-    repo_request = requests.get(repos_url, headers = headers, params = params)
-    LOGGER.debug(repo_request.url)
-
-    repo_list = repo_request.json()
-
-    links = __get_page_links(repo_request)
-    while 'last' in links:
-        repo_request = requests.get(links['next'])
-        LOGGER.debug(repo_request.url)
-        repo_list += repo_request.json()
-        links = __get_page_links(repo_request)
-
-    views_url = GITHUB_API_HOST + "/repos/{0}/traffic/views"
-    clones_url = GITHUB_API_HOST + "/repos/{0}/traffic/clones"
-    referrers_url = GITHUB_API_HOST + "/repos/{0}/traffic/popular/referrers"
-    paths_url = GITHUB_API_HOST + "/repos/{0}/traffic/popular/paths"
-    repo_info_url = GITHUB_API_HOST + "/repos/{0}"
-
-    now = datetime.today()
-    year = now.year
-    month = now.month
-    date_str = now.strftime('%Y%m%d_%H%M')
-    num_repos = len(repo_list)
-    LOGGER.info("Found %d repositories to fetch traffic information for", num_repos)
-    count = 1
-    for repository in repo_list:
-        repo_name = repository['full_name']
-        LOGGER.info('Processing %d/%d: %s', count, num_repos, repo_name)
-
-        repo_data_path = os.path.join(datastore, repo_name, str(year), str(month))
-        os.makedirs(repo_data_path, exist_ok=True)
-
-        r = requests.get(referrers_url.format(repo_name), headers = headers, params = params, stream=True)
-        LOGGER.debug(r.url)
-        with open(os.path.join(repo_data_path, '{0}_referrer.json'.format(date_str)), 'wb') as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
-
-        r = requests.get(paths_url.format(repo_name), headers = headers, params = params, stream=True)
-        LOGGER.debug(r.url)
-        with open(os.path.join(repo_data_path, '{0}_path.json'.format(date_str)), 'wb') as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
-
+    limiter = AdaptiveLimiter(**config.get('concurrency', {}))
+    timeout = config.get('timeout', {})
+
+    return Fetcher(
+        timer, TokenPool.from_config(config), params, limiter = limiter,
+        timeout = (
+            timeout.get('connect', DEFAULT_CONNECT_TIMEOUT),
+            timeout.get('read', DEFAULT_READ_TIMEOUT)
+        ),
+        retries = config.get('retries', DEFAULT_RETRIES),
+        hedge = config.get('hedge', False)
+    )
+
+def new_snapshot_writer(timer, datastore, config):
+    store = SnapshotStore(
+        datastore, config.get('snapshot_compression', 'none'),
+        index = SnapshotIndex(index_path(datastore))
+    )
+
+    return SnapshotWriter(store, timer = timer)
+
+def list_repositories(fetcher):
+    """
+        List the repositories visible to each token in the pool, recording
+        which tokens can see each repository.
+    """
+    repo_list = []
+    seen = set()
+    with fetcher.timer.phase('listing'):
+        for token in fetcher.tokens.tokens:
+            repo_request = fetcher.get('repos', REPOS_URL, token = token)
+
+            token_repos = response_json(repo_request)
+
+            links = __get_page_links(repo_request)
+            while 'last' in links:
+                repo_request = fetcher.get('repos', links['next'], token = token, params = {})
+                token_repos += response_json(repo_request)
+                links = __get_page_links(repo_request)
+
+            fetcher.tokens.register_visibility(token, [repository['full_name'] for repository in token_repos])
+            for repository in token_repos:
+                if repository['full_name'] not in seen:
+                    seen.add(repository['full_name'])
+                    repo_list.append(repository)
+
+    return repo_list
+
+def __write_traffic(db, timer, repo_name, json_data, key, count_measurand, uniques_measurand):
+    df = pd.DataFrame(json_data[key])
+
+    if len(df) > 0:
+        df.set_index(pd.to_datetime(df['timestamp']), inplace=True)
+        df = df.asfreq('D').fillna(0).tz_localize(None)
+
+        with timer.phase('phildb_writes'):
+            db.write(repo_name, 'D', df['count'], measurand = count_measurand)
+            db.write(repo_name, 'D', df['uniques'], measurand = uniques_measurand)
+
+def fetch_repository(fetcher, snapshots, checkpoint, repo_name, now, fetched):
+    """
+        Fetch the traffic of a repository, queueing its snapshots for the
+        snapshot writer and adding the clones, views and repository
+        information responses to fetched for write_repository. fetched keeps
+        whatever was fetched before a failure.
+
+        Safe to run on worker threads as it doesn't touch PhilDB.
+    """
+    timer = fetcher.timer
+    date_str = checkpoint.date_str
+
+    if not checkpoint.is_done(repo_name, 'referrers'):
+        r = fetcher.get('referrers', REFERRERS_URL.format(repo_name), repo_name = repo_name, stream=True)
+        data, gzipped = read_body(r)
+        with timer.phase('snapshot_writes'):
+            snapshots.write(
+                repo_name, now.year, now.month, date_str, 'referrer', data, gzipped,
+                callback = functools.partial(checkpoint.mark, repo_name, 'referrers')
+            )
+
+    if not checkpoint.is_done(repo_name, 'paths'):
+        r = fetcher.get('paths', PATHS_URL.format(repo_name), repo_name = repo_name, stream=True)
+        data, gzipped = read_body(r)
+        with timer.phase('snapshot_writes'):
+            snapshots.write(
+                repo_name, now.year, now.month, date_str, 'path', data, gzipped,
+                callback = functools.partial(checkpoint.mark, repo_name, 'paths')
+            )
+
+    if not checkpoint.is_done(repo_name, 'clones'):
+        clones_request = fetcher.get('clones', CLONES_URL.format(repo_name), repo_name = repo_name)
+        fetched['clones'] = response_json(clones_request)
+
+    if not checkpoint.is_done(repo_name, 'views'):
+        views_request = fetcher.get('views', VIEWS_URL.format(repo_name), repo_name = repo_name)
+        fetched['views'] = response_json(views_request)
+
+    if not checkpoint.is_done(repo_name, 'repo_info'):
+        repo_request = fetcher.get('repo_info', REPO_INFO_URL.format(repo_name), repo_name = repo_name)
+        fetched['repo_info'] = response_json(repo_request)
+
+def write_repository(db, timer, checkpoint, repo_name, now, fetched):
+    """
+        Write what fetch_repository fetched for a repository into PhilDB.
+
+        PhilDB's SQLite sessions can only be used on the thread that created
+        them, so this must always run on the same thread.
+    """
+    if not fetched:
+        return
+
+    with timer.phase('phildb_writes'):
         try:
             db.add_timeseries(repo_name)
         except DuplicateError:
@@ -168,48 +347,298 @@ def collect_traffic_data(datastore):
         except DuplicateError:
             pass
 
-        clones_request = requests.get(clones_url.format(repo_name), headers = headers, params = params)
-        LOGGER.debug(clones_request.url)
-        clones_json = clones_request.json()
-        clones_df = pd.DataFrame(clones_json['clones'])
-
-        if len(clones_df) > 0:
-            clones_df.set_index(pd.to_datetime(clones_df['timestamp']), inplace=True)
-            clones_df = clones_df.asfreq('D').fillna(0).tz_localize(None)
-
-            db.write(repo_name, 'D', clones_df['count'], measurand = 'C')
-            db.write(repo_name, 'D', clones_df['uniques'], measurand = 'UC')
-
-
-        views_request = requests.get(views_url.format(repo_name), headers = headers, params = params)
-        LOGGER.debug(views_request.url)
-        views_json = views_request.json()
-        views_df = pd.DataFrame(views_json['views'])
+    if 'clones' in fetched:
+        __write_traffic(db, timer, repo_name, fetched['clones'], 'clones', 'C', 'UC')
+        checkpoint.mark(repo_name, 'clones')
+
+    if 'views' in fetched:
+        __write_traffic(db, timer, repo_name, fetched['views'], 'views', 'V', 'UV')
+        checkpoint.mark(repo_name, 'views')
+
+    if 'repo_info' in fetched:
+        repo = fetched['repo_info']
+
+        with timer.phase('phildb_writes'):
+            try:
+                db.add_timeseries_instance(repo_name, 'D', '', source = 'GITHUB', measurand = 'S')
+            except DuplicateError:
+                pass
+
+            db.write(repo_name, 'D', pd.Series([repo['stargazers_count']], [now.date()]), measurand = 'S')
+
+            try:
+                db.add_timeseries_instance(repo_name, 'D', '', source = 'GITHUB', measurand = 'W')
+            except DuplicateError:
+                pass
+            db.write(repo_name, 'D', pd.Series([repo['subscribers_count']], [now.date()]), measurand = 'W')
+        checkpoint.mark(repo_name, 'repo_info')
+
+def collect_repository(db, fetcher, snapshots, checkpoint, repo_name, now):
+    """
+        Fetch a repository and write it into PhilDB on the calling thread,
+        keeping whatever was fetched before a failure.
+    """
+    fetched = {}
+    try:
+        fetch_repository(fetcher, snapshots, checkpoint, repo_name, now, fetched)
+    finally:
+        write_repository(db, fetcher.timer, checkpoint, repo_name, now, fetched)
+
+def collect_traffic_data(datastore, progress = False, resume = False, shard = None, config_path = None):
+    timer = RunTimer()
+    # Breaker state and run reports stay in the main datastore, as staging
+    # areas are removed once merged.
+    main_datastore = datastore
+    if shard is not None:
+        os.makedirs(datastore, exist_ok=True)
+        config = load_config(datastore, config_path)
+        datastore = staging_path(datastore, shard)
+        db = open_database(datastore)
+    else:
+        db = open_database(datastore)
+        config = load_config(datastore, config_path)
+
+    fetcher = new_fetcher(timer, config)
+    snapshots = new_snapshot_writer(timer, datastore, config)
+
+    checkpoint = Checkpoint.latest_unfinished(datastore) if resume else None
+    report_suffix = ''
+    if checkpoint is not None:
+        LOGGER.info("Resuming run %s", checkpoint.date_str)
+        now = datetime.strptime(checkpoint.date_str, DATE_FORMAT)
+        # Keep the report of the interrupted run alongside this one.
+        report_suffix = '_resumed_' + datetime.today().strftime(DATE_FORMAT)
+        timer.info['resumed'] = checkpoint.date_str
+    else:
+        if resume:
+            LOGGER.info("No interrupted run found, starting a new run")
+        now = datetime.today()
+        checkpoint = Checkpoint.start(datastore, now.strftime(DATE_FORMAT))
+    date_str = checkpoint.date_str
+
+    repo_list = list_repositories(fetcher)
+    if shard is not None:
+        repo_list = [repository for repository in repo_list if in_shard(repository['full_name'], shard)]
+        timer.info['shard'] = '{0}/{1}'.format(*shard)
+
+    breaker = CircuitBreaker(os.path.join(main_datastore, 'circuit_breaker.json'), config.get('breaker_threshold', DEFAULT_THRESHOLD))
+    skipped = [repository['full_name'] for repository in repo_list if not breaker.allow(repository['full_name'])]
+    if skipped:
+        LOGGER.info("Skipping %d repositories with open circuit breakers", len(skipped))
+        repo_list = [repository for repository in repo_list if repository['full_name'] not in skipped]
+    timer.info['skipped'] = skipped
 
-        if len(views_df) > 0:
-            views_df.set_index(pd.to_datetime(views_df['timestamp']), inplace=True)
-            views_df = views_df.asfreq('D').fillna(0).tz_localize(None)
+    num_repos = len(repo_list)
+    LOGGER.info("Found %d repositories to fetch traffic information for", num_repos)
+    timer.info['num_repos'] = num_repos
+    progress_line = Progress(num_repos) if progress else None
 
-            db.write(repo_name, 'D', views_df['count'], measurand = 'V')
-            db.write(repo_name, 'D', views_df['uniques'], measurand = 'UV')
+    def fetch(repo_name, fetched):
+        with timer.phase('repository'):
+            fetch_repository(fetcher, snapshots, checkpoint, repo_name, now, fetched)
 
-        repo_request = requests.get(repo_info_url.format(repo_name), headers = headers, params = params)
-        LOGGER.debug(repo_request.url)
-        repo = repo_request.json()
+    # Workers only fetch, PhilDB is written from this thread as each
+    # repository completes.
+    executor = ThreadPoolExecutor(max_workers = fetcher.limiter.maximum)
+    futures = {}
+    for repository in repo_list:
+        fetched = {}
+        futures[executor.submit(fetch, repository['full_name'], fetched)] = (repository['full_name'], fetched)
+    failures = []
+    count = 1
+    try:
+        for future in as_completed(futures):
+            repo_name, fetched = futures[future]
+            try:
+                # Write whatever was fetched, even if the fetch then failed.
+                write_repository(db, timer, checkpoint, repo_name, now, fetched)
+                future.result()
+            except Exception as e:
+                LOGGER.warning('Failed %d/%d: %s: %s', count, num_repos, repo_name, e)
+                failures.append(failure_details(repo_name, e))
+                breaker.failure(repo_name, str(e))
+            else:
+                LOGGER.info('Processed %d/%d: %s', count, num_repos, repo_name)
+                breaker.success(repo_name)
+            checkpoint.save()
+
+            if progress_line is not None:
+                progress_line.update(repo_name)
+
+            count += 1
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait = True)
         try:
-            db.add_timeseries_instance(repo_name, 'D', '', source = 'GITHUB', measurand = 'S')
-        except DuplicateError:
-            pass
-
-        db.write(repo_name, 'D', pd.Series([repo['stargazers_count']], [now.date()]), measurand = 'S')
-
+            # All snapshots must be on disk before the run can be reported complete.
+            snapshots.close(raise_errors = False)
+            for repo_name, e in snapshots.take_errors():
+                LOGGER.warning('Failed to write snapshot for %s: %s', repo_name, e)
+                failures.append(failure_details(repo_name, e))
+                breaker.failure(repo_name, str(e))
+        finally:
+            checkpoint.save()
+            breaker.save()
+            if progress_line is not None:
+                progress_line.close()
+
+    timer.info['failures'] = failures
+    if failures:
+        LOGGER.warning("%d of %d repositories failed, see the run report for details", len(failures), num_repos)
+
+    if any(failure['transient'] for failure in failures):
+        # Leave the run resumable so --resume retries what didn't complete.
+        LOGGER.warning("Run left unfinished due to transient failures, use --resume to retry them")
+    else:
+        checkpoint.finish()
+    mark_collection(datastore)
+
+    timer.info['tokens'] = fetcher.tokens.status()
+    timer.info['concurrency'] = fetcher.limiter.report()
+    timer.info['requests'] = fetcher.report()
+    timer.info['snapshots'] = snapshots.report()
+    timer.finish()
+    report_name = date_str if shard is None else '{0}_shard_{1}_of_{2}'.format(date_str, *shard)
+    report_name += report_suffix
+    report_file = timer.write_report(main_datastore, report_name)
+    LOGGER.info("Run report written to %s", report_file)
+
+def merge_staging(datastore, staged = None, keep_staging = False):
+    """
+        Fold the series and snapshots collected into sharded staging areas
+        into the main datastore.
+    """
+    db = open_database(datastore)
+    if staged is None:
+        staged = staged_datastores(datastore)
+
+    for staging in staged:
+        LOGGER.info("Merging %s", staging)
+        staging_db = PhilDB(os.path.join(staging, 'gtc_phildb'))
+        for repo_name in staging_db.list_ids():
+            try:
+                db.add_timeseries(repo_name)
+            except DuplicateError:
+                pass
+
+            for measurand, _, _ in MEASURANDS:
+                try:
+                    ts = staging_db.read(repo_name, 'D', measurand = measurand)
+                except MissingDataError:
+                    # No instance of this measurand in the staging database.
+                    continue
+
+                if len(ts) == 0:
+                    continue
+
+                try:
+                    db.add_timeseries_instance(repo_name, 'D', '', source = 'GITHUB', measurand = measurand)
+                except DuplicateError:
+                    pass
+                db.write(repo_name, 'D', ts.dropna(), measurand = measurand)
+
+        moved = move_snapshots(staging, datastore)
+        LOGGER.info("Moved %d snapshot files from %s", moved, staging)
+
+        if os.path.exists(index_path(staging)):
+            index = SnapshotIndex(index_path(datastore))
+            index.merge(index_path(staging))
+            index.close()
+
+        if not keep_staging:
+            shutil.rmtree(staging)
+
+    mark_collection(datastore)
+
+def run_daemon(datastore, interval = DEFAULT_INTERVAL, listing_refresh = 6 * 3600):
+    """
+        Stay resident, keeping the HTTP connection pool and repository
+        listing warm, and collect each repository at its scheduled slot.
+    """
+    db = open_database(datastore)
+    config = load_config(datastore)
+    schedule = Schedule(os.path.join(datastore, 'daemon_state.json'), interval)
+    breaker = CircuitBreaker(os.path.join(datastore, 'circuit_breaker.json'), config.get('breaker_threshold', DEFAULT_THRESHOLD))
+
+    timer = RunTimer()
+    fetcher = new_fetcher(timer, config)
+    snapshots = new_snapshot_writer(timer, datastore, config)
+    report_due = time.time() + interval
+    # Repositories collected since the datastore was last marked as updated.
+    unmarked = 0
+    repo_names = []
+    listed_at = None
+
+    while True:
+        if listed_at is None or time.time() - listed_at >= listing_refresh:
+            try:
+                repo_names = [repository['full_name'] for repository in list_repositories(fetcher)]
+            except Exception as e:
+                # Keep collecting the previous listing and try again later.
+                LOGGER.warning("Failed to list repositories, retrying in %d seconds: %s", RETRY_DELAY, e)
+                listed_at = time.time() - listing_refresh + RETRY_DELAY
+            else:
+                listed_at = time.time()
+                LOGGER.info("Scheduling %d repositories over %d seconds", len(repo_names), interval)
+
+        if time.time() >= report_due:
+            # Mark a new generation once per cycle rather than per repository,
+            # so server caches and pre-rendered plots last a whole cycle.
+            if unmarked:
+                mark_collection(datastore)
+                unmarked = 0
+            timer.finish()
+            timer.write_report(datastore, datetime.today().strftime(DATE_FORMAT) + '_daemon')
+            timer = RunTimer()
+            fetcher.timer = timer
+            snapshots.timer = timer
+            report_due += interval
+
+        if not repo_names:
+            time.sleep(min(listing_refresh, 60))
+            continue
+
+        due, repo_name = schedule.next_due(repo_names, time.time())
+        wait = due - time.time()
+        if wait > 0:
+            # Sleep in short steps so listing refreshes and reports stay on time.
+            time.sleep(min(wait, 60))
+            continue
+
+        if not breaker.allow(repo_name):
+            schedule.failed(repo_name, breaker.open_until(repo_name))
+            continue
+
+        now = datetime.today()
+        checkpoint = Checkpoint(None, now.strftime(DATE_FORMAT))
+        LOGGER.info('Processing %s', repo_name)
         try:
-            db.add_timeseries_instance(repo_name, 'D', '', source = 'GITHUB', measurand = 'W')
-        except DuplicateError:
-            pass
-        db.write(repo_name, 'D', pd.Series([repo['subscribers_count']], [now.date()]), measurand = 'W')
-
-        count += 1
+            with timer.phase('repository'):
+                collect_repository(db, fetcher, snapshots, checkpoint, repo_name, now)
+            snapshots.flush()
+        except Exception as e:
+            LOGGER.warning('Failed to collect %s: %s', repo_name, e)
+            breaker.failure(repo_name, str(e))
+            schedule.failed(repo_name, time.time())
+        else:
+            breaker.success(repo_name)
+            schedule.collected(repo_name, time.time())
+            unmarked += 1
+        breaker.save()
+
+COMMANDS = {
+    'daemon': daemon_main,
+    'merge': merge_main,
+    'import-snapshots': import_main,
+    'render': render_main,
+}
+
+COMMANDS_HELP = '''commands (see gtc <command> --help):
+  daemon            Run the collector as a long running daemon.
+  merge             Merge sharded staging areas into the main datastore.
+  import-snapshots  Import existing snapshots into the snapshot index.
+  render            Pre-render the dashboard plots for gtc-server.'''
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,44 @@
+"""
+    JSON encoding and decoding using orjson when it is installed, falling
+    back to the standard library json module.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj, indent=False):
+        option = orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option = option)
+else:
+    def loads(data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(obj, indent=False):
+        return json.dumps(obj, indent = 2 if indent else None, sort_keys = True).encode('utf-8')
+
+def load(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+def dump(obj, path, indent=False):
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, indent))
+
+def response_json(response):
+    """
+        Decode the body of a requests response.
+    """
+    return loads(response.content)
@@ -0,0 +1,166 @@
+"""
+    Rendering of the dashboard plots, shared by gtc-server and the
+    pre-rendering stage that writes them into the datastore.
+
+    Pre-rendered files mirror the server's URL paths under
+    <datastore>/rendered, e.g. plot/UV/<user>/<repo>.png, and are stamped
+    with the collection generation they were rendered from.
+"""
+import gzip
+import os
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from .cache import collection_generation
+from .downsample import downsample, pixel_width
+from .sparkline import sparkline_svg, WIDTH as SPARKLINE_WIDTH
+from .tsfile import read_frame, read_mapped
+
+RENDER_DIR = 'rendered'
+GENERATION_NAME = 'generation'
+
+MEASURAND_NAME = {
+    'C': 'Total number of git clones',
+    'UC': 'Number of unique git clones',
+    'V': 'Total number of views',
+    'UV': 'Number of unique views',
+    'S': 'Number of Star Gazers',
+    'W': 'Number of Watchers',
+}
+
+def rendered_path(datastore, relpath):
+    return os.path.join(datastore, RENDER_DIR, *relpath.split('/'))
+
+def rendered_generation(datastore):
+    """
+        The collection generation the pre-rendered files were made from.
+    """
+    try:
+        with open(rendered_path(datastore, GENERATION_NAME), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def plot_title(measurand, user_repo):
+    return "{0} for {1}".format(MEASURAND_NAME[measurand], user_repo)
+
+def plot_figure(ts, title):
+    """
+        Figure of a daily series, downsampled to the figure width.
+    """
+    fig=Figure(figsize=(10,2.5))
+    ax=fig.add_subplot(111)
+
+    downsample(ts.asfreq('D').fillna(0), pixel_width(fig)).plot(ax = ax)
+    ax.set_title(title)
+
+    return fig
+
+def top_ten_figure(df, measurand):
+    """
+        Figure of the cumulative totals of each column of df.
+    """
+    fig=Figure(figsize=(10,5.5))
+    ax=fig.add_subplot(111)
+
+    df = df.fillna(0).cumsum()
+    for ts_id in df.columns:
+        downsample(df[ts_id], pixel_width(fig)).plot(ax = ax, label = ts_id)
+    if len(df.columns) > 0:
+        ax.legend()
+    ax.set_title("Top 10 repositories by cumulative {0}".format(MEASURAND_NAME[measurand].lower()))
+
+    return fig
+
+def sparkline(ts, title):
+    return sparkline_svg(downsample(ts.asfreq('D').fillna(0), SPARKLINE_WIDTH), title)
+
+def png_bytes(fig):
+    fig.tight_layout()
+    canvas=FigureCanvas(fig)
+    png_output = BytesIO()
+    canvas.print_png(png_output)
+    return png_output.getvalue()
+
+def write_rendered(datastore, relpath, content):
+    write_file(rendered_path(datastore, relpath), content)
+
+def write_file(path, content):
+    """
+        Write content to path through a temporary file, so readers never see
+        a partially written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content if isinstance(content, bytes) else content.encode('utf-8'))
+    os.replace(tmp_path, path)
+
+def render_repository(task):
+    """
+        Render the plot and sparkline of one repository and measurand.
+        Returns the number of files written.
+    """
+    datastore, user_repo, measurand, path = task
+    ts = read_mapped(path)
+    if len(ts) == 0:
+        return 0
+
+    title = plot_title(measurand, user_repo)
+    write_rendered(datastore, 'plot/{0}/{1}.png'.format(measurand, user_repo), png_bytes(plot_figure(ts, title)))
+    svg = sparkline(ts, title).encode('utf-8')
+    write_rendered(datastore, 'sparkline/{0}/{1}.svg'.format(measurand, user_repo), svg)
+    # Stored alongside so the server needn't compress it per request.
+    write_rendered(datastore, 'sparkline/{0}/{1}.svg.gz'.format(measurand, user_repo), gzip.compress(svg))
+
+    return 3
+
+def render_top_ten(task):
+    datastore, measurand, paths = task
+    df = read_frame(paths)
+    if len(df.columns) > 0:
+        df = df[df.sum().sort_values(ascending = False).index[:10]]
+    write_rendered(datastore, 'plot/top_ten/{0}.png'.format(measurand), png_bytes(top_ten_figure(df, measurand)))
+
+    return 1
+
+def render_datastore(datastore, db, processes = None):
+    """
+        Render every repository and top ten plot of a datastore in parallel,
+        then stamp the rendered files with the collection they came from.
+    """
+    generation = collection_generation(datastore)
+
+    repository_tasks = []
+    top_ten_tasks = []
+    for measurand in MEASURAND_NAME:
+        paths = [(ts_id, db.get_file_path(ts_id, 'D', measurand = measurand)) for ts_id in db.ts_list(measurand = measurand)]
+        repository_tasks.extend((datastore, ts_id, measurand, path) for ts_id, path in paths)
+        top_ten_tasks.append((datastore, measurand, paths))
+    LOGGER.info("Rendering %d repository series and %d top ten plots", len(repository_tasks), len(top_ten_tasks))
+
+    written = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        futures = dict(
+            [(executor.submit(render_repository, task), task[1] + ' ' + task[2]) for task in repository_tasks]
+            + [(executor.submit(render_top_ten, task), 'top ten ' + task[1]) for task in top_ten_tasks]
+        )
+        for future in as_completed(futures):
+            try:
+                written += future.result()
+            except Exception as e:
+                LOGGER.warning("Failed to render %s: %s", futures[future], e)
+                failed += 1
+
+    write_rendered(datastore, GENERATION_NAME, str(generation))
+    LOGGER.info("Rendered %d files, %d failed", written, failed)
+
+    return written, failed
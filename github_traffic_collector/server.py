@@ -1,96 +1,428 @@
 import argparse
-import glob
+import hashlib
+import numpy as np
 import os
 import pandas as pd
 import seaborn as sns
+import sys
+import threading
+import time
 
 from datetime import date
-from io import BytesIO
 
-from flask import Flask, make_response
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from flask import Flask, abort, g, jsonify, make_response, render_template, request, send_file
+from markupsafe import Markup
 from matplotlib.figure import Figure
 from matplotlib.dates import DateFormatter
 from phildb.database import PhilDB
 
-app = Flask("Github traffic controller data viewer")
+from .cache import LRUCache, SingleFlight, collection_generation
+from .compression import COMPRESSIBLE_TYPES, MIN_SIZE, compress, negotiate
+from .metrics import Registry
+from .render import plot_figure, plot_title, png_bytes, rendered_generation, rendered_path, sparkline as render_sparkline, top_ten_figure
+from .shared_matrix import load_matrix
+from .snapshot_index import SnapshotIndex, index_path
+from .snapshots import find_snapshot, load_snapshot
+from .tsfile import read_frame, read_mapped
+
+app = Flask(
+    "Github traffic controller data viewer",
+    template_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+)
+
+METRICS = Registry()
+REQUEST_LATENCY = METRICS.histogram('gtc_request_duration_seconds', 'Request latency by route.', ['route', 'method', 'status'])
+REQUESTS_IN_FLIGHT = METRICS.gauge('gtc_requests_in_flight', 'Number of requests currently being served.')
+RENDER_DURATION = METRICS.histogram('gtc_render_duration_seconds', 'Time spent rendering Matplotlib figures.', ['route', 'stage'])
+DB_READ_DURATION = METRICS.histogram('gtc_db_read_duration_seconds', 'Time spent reading from PhilDB.', ['operation', 'measurand'])
+CACHE_REQUESTS = METRICS.counter('gtc_cache_requests_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+CACHE_SIZE = METRICS.gauge('gtc_cache_size_bytes', 'Size of cached values.', ['cache'])
+INDEX_QUERY_DURATION = METRICS.histogram('gtc_index_query_duration_seconds', 'Time spent querying the snapshot index.', ['operation', 'kind'])
+COALESCED_REQUESTS = METRICS.counter('gtc_coalesced_requests_total', 'Plot requests by whether they rendered or shared a concurrent rendering.', ['route', 'result'])
+
+INDEX_KINDS = {
+    'referrer': 'referrer',
+    'path': 'popular path',
+}
+
+# Largest number of referrers or paths charted by /plot/top/<kind>.
+MAX_TOP_KEYS = 50
 
-MEASURAND_NAME = {
-    'C': 'Total number of git clones',
-    'UC': 'Number of unique git clones',
-    'V': 'Total number of views',
-    'UV': 'Number of unique views',
-    'S': 'Number of Star Gazers',
-    'W': 'Number of Watchers',
+# Thumbnail renderers for the summary pages: Matplotlib PNGs or SVG sparklines.
+THUMBNAIL_ROUTES = {
+    'png': '/plot/{0}/{1}',
+    'svg': '/sparkline/{0}/{1}',
 }
+THUMBNAIL_RENDERER = 'svg'
+
+# Timeseries decoded by PhilDB, for files the mapped read path can't read,
+# keyed by (repo, freq, measurand) with (start, end) appended for windowed
+# reads.
+SERIES_CACHE_SIZE = 256 * 1024 * 1024
+
+def _series_size(value):
+    usage = value.memory_usage(index = True)
+    # DataFrames report their usage per column.
+    return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+
+series_cache = LRUCache(SERIES_CACHE_SIZE, _series_size)
+
+# Encoded bodies of cacheable responses keyed by (body digest, encoding).
+COMPRESSED_CACHE_SIZE = 64 * 1024 * 1024
+
+compressed_cache = LRUCache(COMPRESSED_CACHE_SIZE, len)
+
+# Rendered HTML fragments (summary thumbnails and snapshot tables).
+FRAGMENT_CACHE_SIZE = 32 * 1024 * 1024
+
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, len)
+
+# Renderings in progress, keyed by request path and query string.
+plot_flights = SingleFlight()
+
+@app.before_request
+def before_request():
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+    generation = collection_generation(DATASTORE)
+    series_cache.validate(generation)
+    fragment_cache.validate(generation)
+
+def compress_response(response):
+    """
+        Encode text responses with the best encoding the client accepts,
+        reusing the encoded body of identical cacheable responses.
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    body = response.get_data()
+    if encoding is None or len(body) < MIN_SIZE:
+        return response
+
+    if response.cache_control.no_store:
+        encoded = compress(body, encoding)
+    else:
+        key = (hashlib.sha1(body).digest(), encoding)
+        encoded, hit = compressed_cache.get_or_load(key, lambda: compress(body, encoding))
+        CACHE_REQUESTS.inc(cache = 'compressed', result = 'hit' if hit else 'miss')
+        CACHE_SIZE.set(compressed_cache.current_size, cache = 'compressed')
+
+    response.set_data(encoded)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def send_rendered(path, mimetype):
+    """
+        Send a pre-rendered file, or its gzip variant when the client
+        accepts it.
+    """
+    if mimetype in COMPRESSIBLE_TYPES:
+        if negotiate(request.headers.get('Accept-Encoding'), ('gzip',)) and os.path.exists(path + '.gz'):
+            response = send_file(path + '.gz', mimetype = mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_file(path, mimetype = mimetype)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    return send_file(path, mimetype = mimetype)
+
+@app.after_request
+def after_request(response):
+    response = compress_response(response)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_LATENCY.observe(
+        time.perf_counter() - g.request_start,
+        route = route, method = request.method, status = response.status_code
+    )
+    return response
+
+@app.teardown_request
+def teardown_request(exception):
+    if 'request_start' in g:
+        REQUESTS_IN_FLIGHT.dec()
+
+def fragment(key, template, load):
+    """
+        A rendered template fragment, rendered from the context returned by
+        load() on a cache miss.
+    """
+    value, hit = fragment_cache.get_or_load(key, lambda: Markup(render_template(template, **load())))
+    CACHE_REQUESTS.inc(cache = 'fragment', result = 'hit' if hit else 'miss')
+    CACHE_SIZE.set(fragment_cache.current_size, cache = 'fragment')
+    return value
+
+def cached_read(key, operation, measurand, load):
+    def timed_load():
+        with DB_READ_DURATION.time(operation = operation, measurand = measurand):
+            return load()
+
+    value, hit = series_cache.get_or_load(key, timed_load)
+    CACHE_REQUESTS.inc(cache = 'series', result = 'hit' if hit else 'miss')
+    CACHE_SIZE.set(series_cache.current_size, cache = 'series')
+    return value
+
+def read_series(user_repo, measurand, start = None, end = None):
+    """
+        Read a series through the memory mapped read path, falling back to
+        PhilDB if the file can't be mapped.
+
+        Mapped series aren't cached: they hold their file open while they
+        live and the page cache already keeps their pages. Only series
+        decoded by PhilDB are kept in series_cache.
+    """
+    path = db.get_file_path(user_repo, 'D', measurand = measurand)
+    try:
+        with DB_READ_DURATION.time(operation = 'read', measurand = measurand):
+            return read_mapped(path, start, end)
+    except ValueError:
+        pass
+
+    key = (user_repo, 'D', measurand)
+    if start is not None or end is not None:
+        key += (start, end)
+
+    def load():
+        ts = db.read(user_repo, 'D', measurand = measurand)
+        return ts.loc[start:end] if start is not None or end is not None else ts
+
+    return cached_read(key, 'read', measurand, load)
+
+def read_all(measurand):
+    """
+        Every series of a measurand as one daily float32 DataFrame, built in
+        a single allocation from the mapped files.
+    """
+    return read_frame(
+        [(ts_id, db.get_file_path(ts_id, 'D', measurand = measurand)) for ts_id in db.ts_list(measurand = measurand)],
+        dtype = np.float32
+    )
+
+# Per process handles on the shared repository x day matrices, by measurand.
+shared_matrices = {}
+shared_matrices_lock = threading.Lock()
+
+def top_matrix(measurand):
+    """
+        The shared memory matrix of a measurand for the current collection,
+        built by the first worker to need it.
+    """
+    generation = collection_generation(DATASTORE)
+    with shared_matrices_lock:
+        current = shared_matrices.get(measurand)
+        if current is not None and current[0] == generation:
+            return current[1]
+
+        with DB_READ_DURATION.time(operation = 'shared_matrix', measurand = measurand):
+            matrix = load_matrix(DATASTORE, measurand, generation, lambda: read_all(measurand))
+        shared_matrices[measurand] = (generation, matrix)
+
+        return matrix
+
+def plot_window():
+    """
+        The start and end query arguments of a plot request as Timestamps.
+    """
+    window = []
+    for name in ('start', 'end'):
+        value = request.args.get(name)
+        try:
+            window.append(pd.Timestamp(value).normalize() if value else None)
+        except ValueError:
+            abort(400)
+
+    return window
+
+def rendered_file(relpath):
+    """
+        Path of a pre-rendered file for the requested resource, if one was
+        rendered from the current collection and no query arguments ask for
+        something else.
+    """
+    if request.args:
+        return None
+    if rendered_generation(DATASTORE) != str(collection_generation(DATASTORE)):
+        return None
+
+    path = rendered_path(DATASTORE, relpath)
+    return path if os.path.exists(path) else None
+
+def coalesce(route, render):
+    """
+        Render the body of the current request, sharing a single rendering
+        between concurrent requests for the same resource.
+    """
+    body, shared = plot_flights.do((request.path, request.query_string), render)
+    COALESCED_REQUESTS.inc(route = route, result = 'shared' if shared else 'rendered')
+    return body
+
+def render_png(fig, route):
+    with RENDER_DURATION.time(route = route, stage = 'png'):
+        return png_bytes(fig)
+
+def image_response(body, content_type = 'image/png'):
+    response=make_response(body)
+    response.headers['Content-Type'] = content_type
+    return response
+
+@app.route("/metrics")
+def metrics():
+    response = make_response(METRICS.expose())
+    response.headers['Content-Type'] = METRICS.content_type
+    response.cache_control.no_store = True
+    return response
 
 @app.route("/")
 def index():
-    return """
-<img src="/plot/top_ten/UV"/>
-<ul>
-  <li><a href="/summary/UV">Unique views summary</a></li>
-  <li><a href="/summary/V">Views summary</a></li>
-  <li><a href="/summary/UC">Unique clones summary</a></li>
-  <li><a href="/summary/C">Clones summary</a></li>
-  <li><a href="/summary/S">Star Gazers summary</a></li>
-  <li><a href="/summary/W">Watchers summary</a></li>
-</ul>
-"""
+    return render_template('index.html')
 
 @app.route("/plot/top_ten/<measurand>")
 def plot_top_ten(measurand):
+    rendered = rendered_file('plot/top_ten/{0}.png'.format(measurand))
+    if rendered is not None:
+        return send_rendered(rendered, 'image/png')
+
+    def render():
+        start, end = plot_window()
+        matrix = top_matrix(measurand)
+        df = matrix.frame(matrix.top(10, start, end), start, end)
+
+        with RENDER_DURATION.time(route = 'top_ten', stage = 'plot'):
+            fig = top_ten_figure(df, measurand)
+
+        return render_png(fig, 'top_ten')
+
+    return image_response(coalesce('top_ten', render))
+
+def index_query_args():
+    kind = request.view_args.get('kind')
+    if kind is not None and kind not in INDEX_KINDS:
+        abort(404)
+
+    column = request.args.get('column', 'count')
+    if column not in ('count', 'uniques'):
+        abort(400)
+
+    return request.args.get('start'), request.args.get('end'), column
+
+@app.route("/plot/top/<kind>")
+def plot_top_snapshot_keys(kind):
+    """
+        Daily 14 day totals of the top N referrers or paths across all
+        repositories (or the one given by the repo argument).
+    """
+    start, end, column = index_query_args()
+    n = request.args.get('n', 10, type = int)
+    if not 1 <= n <= MAX_TOP_KEYS:
+        abort(400)
+    repo = request.args.get('repo')
+
+    def render():
+        with INDEX_QUERY_DURATION.time(operation = 'top', kind = kind):
+            top = [key for key, total in snapshot_index.top(kind, n, start, end, repo, column)]
+            rows = snapshot_index.series(kind, top, start, end, repo, column)
+
+        fig=Figure(figsize=(10,5.5))
+        ax=fig.add_subplot(111)
+
+        with RENDER_DURATION.time(route = 'top_' + kind, stage = 'plot'):
+            if rows:
+                df = pd.DataFrame(rows, columns = ['date', kind, column])
+                df['date'] = pd.to_datetime(df['date'])
+                df.pivot(index = 'date', columns = kind, values = column)[top].plot(ax = ax)
+            ax.set_title("Top {0} {1}s by peak 14 day {2}{3}".format(
+                n, INDEX_KINDS[kind], 'unique views' if column == 'uniques' else 'views',
+                ' for ' + repo if repo else ''
+            ))
+
+        return render_png(fig, 'top_' + kind)
+
+    return image_response(coalesce('top_' + kind, render))
+
+@app.route("/<any(referrers, paths):kinds>/<user>/<repo>")
+def snapshot_index_rows(kinds, user, repo):
+    """
+        Referrer or path counts recorded for a repository, as JSON.
+    """
+    kind = kinds[:-1]
+    start, end, column = index_query_args()
+
+    with INDEX_QUERY_DURATION.time(operation = 'query', kind = kind):
+        if kind == 'referrer':
+            rows = snapshot_index.referrers(user + '/' + repo, start, end)
+        else:
+            rows = snapshot_index.paths(user + '/' + repo, start, end)
+
+    return jsonify([
+        {'date': row_date, kind: key, 'count': count, 'uniques': uniques}
+        for row_date, key, count, uniques in rows
+    ])
 
-    fig=Figure(figsize=(10,5.5))
-    ax=fig.add_subplot(111)
+@app.route("/plot/<measurand>/<user>/<repo>")
+def plot(measurand, user, repo):
+    user_repo = user + '/' + repo
 
-    df = db.read_all('D', measurand=measurand)
+    rendered = rendered_file('plot/{0}/{1}.png'.format(measurand, user_repo))
+    if rendered is not None:
+        return send_rendered(rendered, 'image/png')
 
-    df[
-        (df.sum()).sort_values(ascending=False)[:10].index
-    ].fillna(0).cumsum().plot(ax = ax)
-    ax.set_title("Top 10 repositories by cumulative {0}".format(MEASURAND_NAME[measurand].lower()))
+    def render():
+        start, end = plot_window()
+        ts = read_series(user_repo, measurand, start, end)
 
-    fig.tight_layout()
-    canvas=FigureCanvas(fig)
-    png_output = BytesIO()
-    canvas.print_png(png_output)
-    response=make_response(png_output.getvalue())
-    response.headers['Content-Type'] = 'image/png'
-    return response
-
-@app.route("/plot/<measurand>/<user>/<repo>")
-def plot(measurand, user, repo):
+        with RENDER_DURATION.time(route = 'plot', stage = 'plot'):
+            fig = plot_figure(ts, plot_title(measurand, user_repo))
 
+        return render_png(fig, 'plot')
 
-    fig=Figure(figsize=(10,2.5))
-    ax=fig.add_subplot(111)
+    return image_response(coalesce('plot', render))
 
+@app.route("/sparkline/<measurand>/<user>/<repo>")
+def sparkline(measurand, user, repo):
+    """
+        Lightweight SVG rendering of the plot route for thumbnails.
+    """
     user_repo = user + '/' + repo
 
-    ts = db.read(user_repo, 'D', measurand = measurand).asfreq('D').fillna(0)
+    rendered = rendered_file('sparkline/{0}/{1}.svg'.format(measurand, user_repo))
+    if rendered is not None:
+        return send_rendered(rendered, 'image/svg+xml')
 
-    ts.plot(ax = ax)
+    def render():
+        start, end = plot_window()
+        ts = read_series(user_repo, measurand, start, end)
 
-    ax.set_title("{0} for {1}".format(MEASURAND_NAME[measurand], user_repo))
-    fig.tight_layout()
-    canvas=FigureCanvas(fig)
-    png_output = BytesIO()
-    canvas.print_png(png_output)
-    response=make_response(png_output.getvalue())
-    response.headers['Content-Type'] = 'image/png'
-    return response
+        with RENDER_DURATION.time(route = 'sparkline', stage = 'svg'):
+            return render_sparkline(ts, plot_title(measurand, user_repo))
+
+    return image_response(coalesce('sparkline', render), 'image/svg+xml')
 
 @app.route("/summary/<measurand>")
 def summary(measurand):
-    content = ""
-    img = '<a href="/repo/{1}"><img src="/plot/{0}/{1}" alt="{2}" /></a>\n'
-    for ts_id in db.list_ids():
-        if len(db.read(ts_id, 'D', measurand = measurand)) > 0:
-            title = "{0} for {1}".format(MEASURAND_NAME[measurand], ts_id)
-            content += img.format(measurand, ts_id, title)
-
-    return content
+    renderer = request.args.get('renderer', THUMBNAIL_RENDERER)
+    if renderer not in THUMBNAIL_ROUTES:
+        abort(400)
+
+    def load(ts_id):
+        if len(read_series(ts_id, measurand)) == 0:
+            return {'ts_id': None}
+        return {
+            'ts_id': ts_id,
+            'src': THUMBNAIL_ROUTES[renderer].format(measurand, ts_id),
+            'title': plot_title(measurand, ts_id),
+        }
+
+    thumbnails = [
+        fragment(('thumbnail', measurand, renderer, ts_id), '_thumbnail.html', lambda: load(ts_id))
+        # Repositories whose collection failed part way may lack the measurand.
+        for ts_id in db.ts_list(measurand = measurand)
+    ]
+
+    return render_template('summary.html', thumbnails = thumbnails)
 
 @app.route("/repo/<user>/<repo>/<int:year>/<int:month>/<int:day>")
 def repo_information(user, repo, year, month, day):
@@ -104,46 +436,59 @@ def latest_repo_information(user, repo):
     return repo_for_last_globbed(user, repo, os.path.join('*', '*', ''))
 
 def repo_for_last_globbed(user, repo, glob_start):
-    content = ""
-    img = '<img src="/plot/{0}/{1}" alt="{2}" />\n'
-    title = "{0} for {1}".format(MEASURAND_NAME['UV'], user + '/' + repo)
-    content += img.format('UV', user + '/' + repo, title)
+    user_repo = user + '/' + repo
     data_dir = os.path.join(DATASTORE, user, repo)
 
-    referrer_glob = os.path.join(data_dir, glob_start + "*_referrer.json")
-    infile = glob.glob(referrer_glob)[-1]
-    referrer_data = pd.read_json(infile)
-
-    try:
-        referrer_data.set_index('referrer', inplace=True)
-        content += referrer_data.to_html()
-    except KeyError:
-        content += "<p>No referrer data found</p>"
-
-    path_glob = os.path.join(data_dir, glob_start + "*_path.json")
-    infile = glob.glob(path_glob)[-1]
-    path_data = pd.read_json(infile)
-
-    try:
-        path_data.set_index('title', inplace=True)
-        content += path_data.to_html()
-    except KeyError:
-        content += "<p>No paths data found</p>"
+    return render_template(
+        'repo.html', user_repo = user_repo, title = plot_title('UV', user_repo),
+        referrers = snapshot_table(find_snapshot(data_dir, glob_start, 'referrer'), 'referrer', 'referrer'),
+        paths = snapshot_table(find_snapshot(data_dir, glob_start, 'path'), 'title', 'paths'),
+    )
+
+def snapshot_table(infile, index, name):
+    """
+        HTML table of a referrer or path snapshot indexed by the given
+        column, cached by snapshot file.
+    """
+    def load():
+        rows = load_snapshot(infile) if infile is not None else []
+        if any(index not in row for row in rows):
+            rows = []
+        columns = []
+        for row in rows:
+            columns.extend(column for column in row if column != index and column not in columns)
+        return {'rows': rows, 'columns': columns, 'index': index, 'name': name}
+
+    return fragment(('snapshot_table', infile, index), '_snapshot_table.html', load)
+
+def configure(datastore, thumbnails = None):
+    """
+        Point the application at a datastore.
+    """
+    global DATASTORE, db, snapshot_index, THUMBNAIL_RENDERER
+    DATASTORE = datastore
+    db = PhilDB(os.path.join(datastore, 'gtc_phildb'))
+    snapshot_index = SnapshotIndex(index_path(datastore))
+    if thumbnails is not None:
+        THUMBNAIL_RENDERER = thumbnails
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] == 'export':
+        # Imported here as the export module builds on this one.
+        from .export import export_main
+        return export_main(argv[1:])
 
-
-    return content
-
-def main():
     parser = argparse.ArgumentParser(description='Github traffic collector server.')
     parser.add_argument('datastore', help="Location of datastore to visualise")
     parser.add_argument('--debug', action="store_true", help="Location of datastore to visualise")
+    parser.add_argument('--thumbnails', choices = sorted(THUMBNAIL_ROUTES), default = THUMBNAIL_RENDERER,
+        help="Renderer for summary page thumbnails (default: %(default)s)")
 
-    args = parser.parse_args()
-    global DATASTORE
-    DATASTORE = args.datastore
-
-    global db
-    db = PhilDB(os.path.join(args.datastore, 'gtc_phildb'))
+    args = parser.parse_args(argv)
+    configure(args.datastore, args.thumbnails)
     app.run(debug = args.debug)
 
 if __name__ == "__main__":
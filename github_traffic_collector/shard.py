@@ -0,0 +1,68 @@
+import argparse
+import os
+import shutil
+import zlib
+
+from .snapshots import MANIFEST_NAME, POINTER_LOG_NAME, merge_manifest
+
+STAGING_DIR = 'staging'
+
+# Entries of a datastore that are not repository snapshot trees.
+DATASTORE_ENTRIES = ('gtc_phildb', 'runs', STAGING_DIR, 'config.yaml', 'daemon_state.json', 'circuit_breaker.json',
+    'snapshot_index.sqlite', 'snapshot_index.sqlite-journal', 'rendered')
+
+def parse_shard(spec):
+    """
+        Parse a shard specification of the form 'K/N' (1 <= K <= N).
+    """
+    try:
+        index, count = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must be given as K/N, e.g. 3/8")
+
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("Shard K/N requires 1 <= K <= N")
+
+    return index, count
+
+def in_shard(repo_name, shard):
+    index, count = shard
+    return zlib.crc32(repo_name.encode('utf-8')) % count == index - 1
+
+def staging_path(datastore, shard):
+    return os.path.join(datastore, STAGING_DIR, 'shard_{0}_of_{1}'.format(*shard))
+
+def staged_datastores(datastore):
+    staging = os.path.join(datastore, STAGING_DIR)
+    if not os.path.isdir(staging):
+        return []
+
+    return sorted(
+        os.path.join(staging, name) for name in os.listdir(staging)
+        if os.path.isdir(os.path.join(staging, name))
+    )
+
+def move_snapshots(staging, datastore):
+    """
+        Move snapshot files from a staging datastore into the main datastore,
+        returning the number of files moved.
+    """
+    moved = 0
+    for entry in os.listdir(staging):
+        if entry in DATASTORE_ENTRIES:
+            continue
+
+        top = os.path.join(staging, entry)
+        for dirpath, dirnames, filenames in os.walk(top):
+            target_dir = os.path.join(datastore, os.path.relpath(dirpath, staging))
+            os.makedirs(target_dir, exist_ok=True)
+            if MANIFEST_NAME in filenames or POINTER_LOG_NAME in filenames:
+                merge_manifest(dirpath, target_dir)
+            for filename in filenames:
+                if filename in (MANIFEST_NAME, POINTER_LOG_NAME):
+                    continue
+                # shutil.move renames when on the same filesystem.
+                shutil.move(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+                moved += 1
+
+    return moved
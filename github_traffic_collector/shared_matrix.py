@@ -0,0 +1,171 @@
+"""
+    Repository by day matrices of a measurand held in shared memory, so that
+    all server worker processes read the same copy.
+
+    Each block starts with a small header (a ready flag, the header length and
+    a JSON description holding the repository column order and first date)
+    followed by a float32 (days x repositories) matrix.
+"""
+import hashlib
+import json
+import os
+import struct
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+PREFIX = struct.Struct('<II')
+READY = 1
+ALIGNMENT = 16
+ATTACH_TIMEOUT = 60
+
+def block_name(datastore, measurand, generation):
+    digest = hashlib.sha1(os.path.abspath(datastore).encode('utf-8')).hexdigest()[:12]
+    return 'gtc_{0}_{1}_{2}'.format(digest, measurand, generation)
+
+def _untrack(shm):
+    # The block outlives the process that created or attached it; stop the
+    # resource tracker unlinking it when this process exits.
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+class SharedMatrix(object):
+
+    def __init__(self, shm):
+        self.shm = shm
+        flag, header_length = PREFIX.unpack_from(shm.buf, 0)
+        header = json.loads(bytes(shm.buf[PREFIX.size:PREFIX.size + header_length]).decode('utf-8'))
+        self.ids = header['ids']
+        self.columns = dict((ts_id, i) for i, ts_id in enumerate(self.ids))
+        self.start = pd.Timestamp(header['start'])
+        self.days = header['days']
+        self.values = np.ndarray(
+            (self.days, len(self.ids)), dtype=np.float32,
+            buffer=shm.buf, offset=header['offset']
+        )
+        self.values.flags.writeable = False
+
+    @classmethod
+    def create(cls, name, frame):
+        """
+            Create a shared block holding frame (dates x repositories).
+        """
+        if len(frame) > 0:
+            frame = frame.asfreq('D')
+        ids = [str(column) for column in frame.columns]
+        start = frame.index[0] if len(frame) > 0 else pd.Timestamp('1970-01-01')
+        header = {'ids': ids, 'start': start.isoformat(), 'days': len(frame)}
+
+        # The offset is part of the header, so size it with a placeholder first.
+        header['offset'] = 0
+        header_length = len(json.dumps(header)) + 32
+        offset = -(-(PREFIX.size + header_length) // ALIGNMENT) * ALIGNMENT
+        header['offset'] = offset
+        encoded = json.dumps(header).encode('utf-8').ljust(header_length)
+
+        size = offset + max(frame.size, 1) * 4
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _untrack(shm)
+        PREFIX.pack_into(shm.buf, 0, 0, header_length)
+        shm.buf[PREFIX.size:PREFIX.size + header_length] = encoded
+        data = np.ndarray(frame.shape, dtype=np.float32, buffer=shm.buf, offset=offset)
+        data[:] = frame.values
+        del data
+        PREFIX.pack_into(shm.buf, 0, READY, header_length)
+
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name, timeout=ATTACH_TIMEOUT):
+        shm = shared_memory.SharedMemory(name=name)
+        _untrack(shm)
+        deadline = time.monotonic() + timeout
+        while PREFIX.unpack_from(shm.buf, 0)[0] != READY:
+            if time.monotonic() > deadline:
+                shm.close()
+                raise TimeoutError("Shared matrix {0} was never completed".format(name))
+            time.sleep(0.01)
+
+        return cls(shm)
+
+    @property
+    def index(self):
+        return pd.date_range(self.start, periods=self.days, freq='D', name='date')
+
+    def rows(self, start=None, end=None):
+        """
+            Slice of the rows between start and end (inclusive dates).
+        """
+        lo = 0 if start is None else self._offset(start)
+        hi = self.days if end is None else self._offset(end) + 1
+        return slice(min(max(lo, 0), self.days), min(max(hi, 0), self.days))
+
+    def _offset(self, value):
+        return (pd.Timestamp(value).normalize() - self.start).days
+
+    def totals(self, start=None, end=None):
+        return np.nansum(self.values[self.rows(start, end)], axis=0)
+
+    def top(self, n, start=None, end=None):
+        """
+            The n repositories with the largest totals between start and end,
+            largest first.
+        """
+        order = np.argsort(self.totals(start, end))[::-1][:n]
+        return [self.ids[i] for i in order]
+
+    def frame(self, ids, start=None, end=None):
+        """
+            DataFrame of the columns for the given repositories.
+        """
+        rows = self.rows(start, end)
+        columns = [self.columns[ts_id] for ts_id in ids]
+        return pd.DataFrame(self.values[rows][:, columns], index=self.index[rows], columns=ids)
+
+    def close(self):
+        self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+def load_matrix(datastore, measurand, generation, load_frame):
+    """
+        Attach to the shared matrix of a measurand for the given collection
+        generation, building it with load_frame() if no worker has yet.
+    """
+    name = block_name(datastore, measurand, generation)
+    try:
+        return SharedMatrix.attach(name)
+    except FileNotFoundError:
+        pass
+
+    frame = load_frame()
+    try:
+        matrix = SharedMatrix.create(name, frame)
+    except FileExistsError:
+        # Another worker is building it concurrently.
+        return SharedMatrix.attach(name)
+
+    # Remove the block of the previous generation, workers still attached to
+    # it keep their mapping until they move on.
+    pointer = os.path.join(datastore, '.shared_matrix_{0}'.format(measurand))
+    if os.path.exists(pointer):
+        with open(pointer, 'r') as f:
+            previous = f.read().strip()
+        if previous and previous != name:
+            try:
+                stale = shared_memory.SharedMemory(name=previous)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+    with open(pointer, 'w') as f:
+        f.write(name)
+
+    return matrix
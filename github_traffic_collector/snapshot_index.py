@@ -0,0 +1,284 @@
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+LOGGER = logging.getLogger(__name__)
+
+from .shard import DATASTORE_ENTRIES
+from .snapshots import load_manifest, load_snapshot, snapshot_date, snapshot_kind
+
+INDEX_NAME = 'snapshot_index.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS referrers (
+    repo TEXT NOT NULL,
+    date TEXT NOT NULL,
+    referrer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    uniques INTEGER NOT NULL,
+    PRIMARY KEY (repo, date, referrer)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS referrers_by_date ON referrers (date, referrer);
+CREATE TABLE IF NOT EXISTS paths (
+    repo TEXT NOT NULL,
+    date TEXT NOT NULL,
+    path TEXT NOT NULL,
+    title TEXT,
+    count INTEGER NOT NULL,
+    uniques INTEGER NOT NULL,
+    PRIMARY KEY (repo, date, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS paths_by_date ON paths (date, path);
+CREATE TABLE IF NOT EXISTS imported (
+    snapshot TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+BATCH_SIZE = 1000
+
+def index_path(datastore):
+    return os.path.join(datastore, INDEX_NAME)
+
+class SnapshotIndex(object):
+    """
+        Consolidated SQLite store of referrer and path counts indexed by
+        repository and date.
+
+        Snapshots are keyed by '<repo>/<year>/<month>/<file name>' and
+        recorded as imported so repeated imports only process new files.
+
+        Counts are Github's totals over the 14 days up to the snapshot date.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def commit(self):
+        with self._lock:
+            self.connection.commit()
+
+    def imported(self):
+        with self._lock:
+            return set(row[0] for row in self.connection.execute('SELECT snapshot FROM imported'))
+
+    def merge(self, other_path):
+        """
+            Merge the contents of another snapshot index into this one.
+        """
+        with self._lock:
+            self.connection.execute('ATTACH DATABASE ? AS other', (other_path,))
+            try:
+                for table in ('referrers', 'paths', 'imported'):
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO {0} SELECT * FROM other.{0}'.format(table)
+                    )
+                self.connection.commit()
+            finally:
+                self.connection.execute('DETACH DATABASE other')
+
+    def skip(self, snapshot):
+        """
+            Record a snapshot as imported without adding any rows.
+        """
+        with self._lock:
+            self.connection.execute('INSERT OR IGNORE INTO imported VALUES (?)', (snapshot,))
+
+    def add(self, repo, date, kind, rows, snapshot=None):
+        """
+            Add the rows of a referrer or path snapshot, replacing any rows
+            already stored for the repository and date.
+        """
+        with self._lock:
+            self._add(repo, date, kind, rows, snapshot)
+
+    def _add(self, repo, date, kind, rows, snapshot):
+        if kind == 'referrer':
+            self.connection.execute('DELETE FROM referrers WHERE repo = ? AND date = ?', (repo, date))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO referrers VALUES (?, ?, ?, ?, ?)',
+                [(repo, date, row['referrer'], row['count'], row['uniques']) for row in rows]
+            )
+        else:
+            self.connection.execute('DELETE FROM paths WHERE repo = ? AND date = ?', (repo, date))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?, ?, ?)',
+                [(repo, date, row['path'], row.get('title'), row['count'], row['uniques']) for row in rows]
+            )
+
+        if snapshot is not None:
+            self.connection.execute('INSERT OR IGNORE INTO imported VALUES (?)', (snapshot,))
+
+    def referrers(self, repo, start=None, end=None):
+        return self._query('referrer', repo, start, end)
+
+    def paths(self, repo, start=None, end=None):
+        return self._query('path', repo, start, end)
+
+    def _query(self, kind, repo, start, end):
+        table, key = TABLES[kind]
+        sql = 'SELECT date, {0}, count, uniques FROM {1} WHERE repo = ?'.format(key, table)
+        where, args = _date_range(start, end)
+
+        with self._lock:
+            return self.connection.execute(sql + where + ' ORDER BY date', [repo] + args).fetchall()
+
+    def top(self, kind, n=10, start=None, end=None, repo=None, column='count'):
+        """
+            The n referrers (or paths) with the largest count (or uniques)
+            over the date range, across all repositories unless one is given.
+            Returns a list of (referrer, total) pairs.
+
+            Each snapshot is already a 14 day total, so summing overlapping
+            snapshots would count each visit many times over. Instead the
+            total is the peak 14 day count of each repository in the range,
+            summed across repositories.
+        """
+        table, key = TABLES[kind]
+        where, args = _date_range(start, end)
+        if repo is not None:
+            where += ' AND repo = ?'
+            args.append(repo)
+        sql = (
+            'SELECT {0}, SUM(peak) AS total FROM ('
+            'SELECT repo, {0}, MAX({1}) AS peak FROM {2} WHERE 1 = 1{3} GROUP BY repo, {0}'
+            ') GROUP BY {0} ORDER BY total DESC LIMIT ?'
+        ).format(key, COLUMNS[column], table, where)
+
+        with self._lock:
+            return self.connection.execute(sql, args + [n]).fetchall()
+
+    def series(self, kind, keys, start=None, end=None, repo=None, column='count'):
+        """
+            Daily totals of the given referrers (or paths) summed across
+            repositories unless one is given. Returns (date, key, total) rows.
+        """
+        if not keys:
+            return []
+
+        table, key = TABLES[kind]
+        where, args = _date_range(start, end)
+        if repo is not None:
+            where += ' AND repo = ?'
+            args.append(repo)
+        where += ' AND {0} IN ({1})'.format(key, ', '.join('?' * len(keys)))
+        args.extend(keys)
+        sql = 'SELECT date, {0}, SUM({1}) FROM {2} WHERE 1 = 1{3} GROUP BY date, {0} ORDER BY date'.format(
+            key, COLUMNS[column], table, where
+        )
+
+        with self._lock:
+            return self.connection.execute(sql, args).fetchall()
+
+TABLES = {
+    'referrer': ('referrers', 'referrer'),
+    'path': ('paths', 'path'),
+}
+
+# Whitelist of value columns that can be aggregated.
+COLUMNS = {
+    'count': 'count',
+    'uniques': 'uniques',
+}
+
+def _date_range(start, end):
+    where = ''
+    args = []
+    if start is not None:
+        where += ' AND date >= ?'
+        args.append(start)
+    if end is not None:
+        where += ' AND date <= ?'
+        args.append(end)
+
+    return where, args
+
+def scan_snapshots(datastore):
+    """
+        Yield (snapshot key, file path) for every referrer and path snapshot
+        in a datastore, including deduplicated snapshots recorded in manifests.
+    """
+    for user in sorted(os.listdir(datastore)):
+        user_dir = os.path.join(datastore, user)
+        if user in DATASTORE_ENTRIES or not os.path.isdir(user_dir):
+            continue
+
+        for repo in sorted(os.listdir(user_dir)):
+            repo_dir = os.path.join(user_dir, repo)
+            if not os.path.isdir(repo_dir):
+                continue
+            repo_name = user + '/' + repo
+
+            files = set()
+            for dirpath, dirnames, filenames in os.walk(repo_dir):
+                for filename in filenames:
+                    if snapshot_kind(filename) is not None:
+                        path = os.path.join(dirpath, filename)
+                        relpath = os.path.relpath(path, repo_dir).replace(os.sep, '/')
+                        files.add(relpath)
+                        yield repo_name + '/' + relpath, path
+
+            # Snapshot files take precedence over pointers of the same name.
+            for relpath, target in load_manifest(repo_dir)['pointers'].items():
+                relpath = relpath.replace(os.sep, '/')
+                if relpath not in files:
+                    yield repo_name + '/' + relpath, os.path.join(repo_dir, target)
+
+def parse_snapshot(task):
+    """
+        Parse one snapshot file, returning (key, repo, date, kind, rows).
+    """
+    key, path = task
+    user, repo, _ = key.split('/', 2)
+    filename = key.rsplit('/', 1)[-1]
+
+    return key, user + '/' + repo, snapshot_date(filename), snapshot_kind(filename), load_snapshot(path)
+
+def import_snapshots(datastore, processes=None):
+    """
+        Import all snapshot files of a datastore into its snapshot index,
+        parsing files in parallel. Files already imported are skipped, so an
+        interrupted import resumes where it left off.
+    """
+    index = SnapshotIndex(index_path(datastore))
+    done = index.imported()
+    tasks = [task for task in scan_snapshots(datastore) if task[0] not in done]
+    # Import in date order so the latest snapshot of a day wins.
+    tasks.sort(key=lambda task: task[0].rsplit('/', 1)[-1])
+    LOGGER.info("Importing %d snapshots (%d already imported)", len(tasks), len(done))
+
+    imported = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for start in range(0, len(tasks), BATCH_SIZE):
+            batch = tasks[start:start + BATCH_SIZE]
+            futures = [executor.submit(parse_snapshot, task) for task in batch]
+            for task, future in zip(batch, futures):
+                try:
+                    key, repo, date, kind, rows = future.result()
+                    if not isinstance(rows, list):
+                        # Error bodies (e.g. a 403 message) saved as snapshots
+                        # by older versions; mark them so they aren't retried.
+                        index.skip(key)
+                        raise ValueError("snapshot is not a list of {0} counts".format(kind))
+                    index.add(repo, date, kind, rows, snapshot=key)
+                except Exception as e:
+                    LOGGER.warning("Failed to import %s: %s", task[1], e)
+                    failed += 1
+                    continue
+                imported += 1
+            # Each batch is committed with its imported markers, so a restart
+            # picks up from the last completed batch.
+            index.commit()
+            LOGGER.info("Imported %d/%d snapshots", imported + failed, len(tasks))
+
+    index.close()
+
+    return imported, failed
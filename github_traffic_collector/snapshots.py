@@ -0,0 +1,321 @@
+import fnmatch
+import glob
+import gzip
+import hashlib
+import os
+import queue
+import threading
+
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import jsonio
+
+MANIFEST_NAME = 'snapshot_manifest.json'
+POINTER_LOG_NAME = 'snapshot_pointers.log'
+SNAPSHOT_KINDS = ('referrer', 'path')
+
+# File suffix for each supported snapshot compression.
+COMPRESSION_SUFFIXES = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+def snapshot_name(date_str, kind, compression='none'):
+    return '{0}_{1}.json{2}'.format(date_str, kind, COMPRESSION_SUFFIXES[compression])
+
+def snapshot_date(filename):
+    """
+        ISO date of a snapshot from its date stamped file name.
+    """
+    return datetime.strptime(filename[:8], '%Y%m%d').strftime('%Y-%m-%d')
+
+def snapshot_kind(filename):
+    for suffix in COMPRESSION_SUFFIXES.values():
+        for kind in SNAPSHOT_KINDS:
+            if filename.endswith('_{0}.json{1}'.format(kind, suffix)):
+                return kind
+
+    return None
+
+def compression_for(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return compression
+
+    return 'none'
+
+def open_snapshot(path):
+    """
+        Open a snapshot file for reading, decompressing it as it is read.
+    """
+    compression = compression_for(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("The zstandard package is required to read {0}".format(path))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+    return open(path, 'rb')
+
+def load_snapshot(path):
+    with open_snapshot(path) as f:
+        return jsonio.loads(f.read())
+
+def load_manifest(data_dir):
+    """
+        Load a repository's manifest: the latest snapshot of each kind and
+        the pointers from deduplicated snapshots to the file holding their
+        content.
+
+        The latest snapshots are kept in snapshot_manifest.json, which only
+        changes when a new snapshot file is written, and pointers are
+        appended to snapshot_pointers.log. Manifests written before the log
+        existed hold their pointers in the JSON file.
+    """
+    manifest = {'latest': {}, 'pointers': {}}
+    path = os.path.join(data_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        data = jsonio.load(path)
+        manifest['latest'] = data.get('latest', {})
+        manifest['pointers'].update(data.get('pointers', {}))
+
+    log_path = os.path.join(data_dir, POINTER_LOG_NAME)
+    if os.path.exists(log_path):
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                relpath, _, target = line.rstrip('\n').partition('\t')
+                if target:
+                    manifest['pointers'][relpath] = target
+
+    return manifest
+
+def load_latest(data_dir):
+    path = os.path.join(data_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+
+    return jsonio.load(path).get('latest', {})
+
+def save_latest(data_dir, latest):
+    path = os.path.join(data_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        # Move pointers of an old style manifest into the log.
+        pointers = jsonio.load(path).get('pointers')
+        if pointers:
+            append_pointers(data_dir, pointers)
+
+    tmp_path = path + '.tmp'
+    jsonio.dump({'latest': latest}, tmp_path)
+    os.replace(tmp_path, path)
+
+def append_pointers(data_dir, pointers):
+    with open(os.path.join(data_dir, POINTER_LOG_NAME), 'a', encoding='utf-8') as f:
+        for relpath, target in pointers.items():
+            f.write('{0}\t{1}\n'.format(relpath, target))
+
+def merge_manifest(staged_dir, data_dir):
+    """
+        Merge the manifest of a staged repository tree into the manifest of
+        the same repository in the main datastore.
+    """
+    staged = load_manifest(staged_dir)
+    if staged['pointers']:
+        append_pointers(data_dir, staged['pointers'])
+    if staged['latest']:
+        latest = load_latest(data_dir)
+        latest.update(staged['latest'])
+        save_latest(data_dir, latest)
+
+class SnapshotStore(object):
+    """
+        Writes referrer and path snapshots, skipping content identical to the
+        last snapshot of the same kind for a repository.
+
+        Unchanged snapshots are recorded in the repository's manifest as a
+        pointer to the file holding the identical content. A snapshot file
+        takes precedence over a pointer with the same name.
+
+        Snapshots are optionally stored compressed with gzip or zstd. With gzip
+        a response body already gzip encoded by the server is stored as is.
+
+        If a snapshot index is given, the referrer and path counts of every
+        snapshot are also added to it.
+    """
+
+    def __init__(self, datastore, compression='none', index=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError("Unknown snapshot compression: {0}".format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("The zstandard package is required for zstd snapshot compression")
+
+        self.datastore = datastore
+        self.compression = compression
+        self.index = index
+        self.written = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+
+    def encode(self, data, gzipped=None):
+        if self.compression == 'gzip':
+            return gzipped if gzipped is not None else gzip.compress(data)
+        elif self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(data)
+
+        return data
+
+    def write(self, repo_name, year, month, date_str, kind, data, gzipped=None):
+        """
+            Store a snapshot. data is the decoded response body, gzipped the
+            body as gzip encoded by the server, if it was.
+        """
+        data_dir = os.path.join(self.datastore, repo_name)
+        relpath = os.path.join(str(year), str(month), snapshot_name(date_str, kind, self.compression))
+        digest = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            latest = load_latest(data_dir)
+            current = latest.get(kind)
+            if (
+                current is not None and current['hash'] == digest
+                and current['path'] != relpath
+                and os.path.exists(os.path.join(data_dir, current['path']))
+            ):
+                append_pointers(data_dir, {relpath: current['path']})
+                self.deduplicated += 1
+            else:
+                path = os.path.join(data_dir, relpath)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(self.encode(data, gzipped))
+                os.replace(tmp_path, path)
+                latest[kind] = {'hash': digest, 'path': relpath}
+                save_latest(data_dir, latest)
+                self.written += 1
+
+        if self.index is not None:
+            rows = jsonio.loads(data)
+            if isinstance(rows, list):
+                key = repo_name + '/' + relpath.replace(os.sep, '/')
+                self.index.add(repo_name, snapshot_date(date_str), kind, rows, snapshot=key)
+
+    def commit(self):
+        if self.index is not None:
+            self.index.commit()
+
+    def report(self):
+        return {
+            'written': self.written,
+            'deduplicated': self.deduplicated,
+        }
+
+class SnapshotWriter(object):
+    """
+        Persists snapshots on a dedicated thread fed by a bounded queue, so
+        disk latency overlaps with fetching instead of adding to it.
+
+        Callers block only when the queue is full. Errors raised while writing
+        are recorded with the repository they belong to and re-raised from
+        flush() and close(), or can be collected with take_errors().
+    """
+
+    def __init__(self, store, maxsize=64, timer=None):
+        self.store = store
+        self.timer = timer
+        self.errors = []
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, repo_name, year, month, date_str, kind, data, gzipped=None, callback=None):
+        """
+            Queue a snapshot to be written, calling callback once it is
+            safely on disk.
+        """
+        self._queue.put(((repo_name, year, month, date_str, kind, data, gzipped), callback))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                args, callback = item
+                if self.timer is not None:
+                    with self.timer.phase('snapshot_io'):
+                        self.store.write(*args)
+                else:
+                    self.store.write(*args)
+                if callback is not None:
+                    callback()
+                if self._queue.empty():
+                    self.store.commit()
+            except Exception as e:
+                self.errors.append((args[0], e))
+            finally:
+                self._queue.task_done()
+
+    def take_errors(self):
+        """
+            Return and clear the (repository, exception) pairs of failed
+            writes.
+        """
+        errors, self.errors = self.errors, []
+        return errors
+
+    def _raise_errors(self):
+        errors = self.take_errors()
+        if errors:
+            raise errors[0][1]
+
+    def flush(self):
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self, raise_errors=True):
+        self._queue.put(None)
+        self._thread.join()
+        self.store.commit()
+        if raise_errors:
+            self._raise_errors()
+
+    def report(self):
+        return self.store.report()
+
+def find_snapshot(data_dir, glob_start, kind):
+    """
+        Return the path of the file holding the latest snapshot of the given
+        kind matching glob_start (relative to the repository directory),
+        resolving deduplicated snapshots through the manifest. Returns None if
+        no snapshot matches.
+    """
+    patterns = [
+        glob_start + '*_{0}.json{1}'.format(kind, suffix)
+        for suffix in COMPRESSION_SUFFIXES.values()
+    ]
+
+    candidates = {}
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(data_dir, pattern)):
+            candidates[os.path.relpath(path, data_dir)] = path
+
+    pointers = load_manifest(data_dir)['pointers']
+    for relpath, target in pointers.items():
+        if any(fnmatch.fnmatch(relpath, pattern) for pattern in patterns):
+            candidates.setdefault(relpath, os.path.join(data_dir, target))
+
+    if not candidates:
+        return None
+
+    # Snapshot names start with their date stamp, month directories are not
+    # zero padded so order by name rather than by the full path.
+    latest = max(candidates, key=os.path.basename)
+
+    return candidates[latest]
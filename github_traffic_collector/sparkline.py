@@ -0,0 +1,59 @@
+"""
+    Minimal SVG sparklines rendered straight from series values, for
+    thumbnails where a full Matplotlib figure is overkill.
+"""
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+WIDTH = 600
+HEIGHT = 120
+TITLE_HEIGHT = 18
+PADDING = 2
+
+def path_data(values, width, height, top = 0):
+    """
+        SVG path data for a line through values scaled to fill the box of the
+        given size below top.
+    """
+    values = np.nan_to_num(np.asarray(values, dtype = np.float64))
+    if len(values) == 0:
+        return ''
+
+    low, high = values.min(), values.max()
+    span = high - low if high > low else 1.0
+    x = np.linspace(PADDING, width - PADDING, len(values)) if len(values) > 1 else np.array([width / 2.0])
+    y = top + PADDING + (height - 2 * PADDING) * (1.0 - (values - low) / span)
+
+    points = ' '.join('{0:.1f},{1:.1f}'.format(px, py) for px, py in zip(x, y))
+    return 'M' + points.replace(' ', ' L', 1) if len(values) > 1 else 'M{0} h0'.format(points)
+
+def sparkline_svg(ts, title = '', width = WIDTH, height = HEIGHT):
+    """
+        Render a Series as an SVG sparkline with an optional title and the
+        latest and maximum values.
+    """
+    top = TITLE_HEIGHT if title else 0
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">'.format(width, height),
+        '<title>{0}</title>'.format(escape(title)),
+    ]
+    if title:
+        parts.append(
+            '<text x="{0}" y="13" font-family="sans-serif" font-size="12">{1}</text>'.format(PADDING, escape(title))
+        )
+
+    values = ts.values
+    if len(values) > 0:
+        parts.append(
+            '<path d="{0}" fill="none" stroke="#4c72b0" stroke-width="1.5"/>'.format(
+                path_data(values, width, height - top, top)
+            )
+        )
+        parts.append(
+            '<text x="{0}" y="13" font-family="sans-serif" font-size="11" text-anchor="end">'
+            'latest {1:g}, max {2:g}</text>'.format(width - PADDING, np.nan_to_num(values[-1]), np.nanmax(values))
+        )
+    parts.append('</svg>')
+
+    return '\n'.join(parts)
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from . import jsonio
+
+PERCENTILES = (50, 90, 95, 99)
+
+def percentile(values, q):
+    """
+        Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(round(q / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+def summarise(durations):
+    summary = {
+        'count': len(durations),
+        'total': sum(durations),
+        'max': max(durations) if durations else None,
+    }
+    for q in PERCENTILES:
+        summary['p{0}'.format(q)] = percentile(durations, q)
+
+    return summary
+
+class RunTimer(object):
+    """
+        Collects wall-clock timings for the phases of a collection run and
+        for each API endpoint requested.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.phases = defaultdict(list)
+        self.endpoints = defaultdict(list)
+        self.info = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name].append(time.perf_counter() - start)
+
+    @contextmanager
+    def endpoint(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.endpoints[name].append(time.perf_counter() - start)
+
+    def record_endpoint(self, name, duration):
+        self.endpoints[name].append(duration)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def report(self):
+        finished = self.finished if self.finished is not None else time.time()
+        report = {
+            'started': self.started,
+            'finished': finished,
+            'elapsed': finished - self.started,
+            'phases': dict((name, summarise(d)) for name, d in self.phases.items()),
+            'endpoints': dict((name, summarise(d)) for name, d in self.endpoints.items()),
+        }
+        report.update(self.info)
+
+        return report
+
+    def write_report(self, datastore, date_str):
+        runs_path = os.path.join(datastore, 'runs')
+        os.makedirs(runs_path, exist_ok=True)
+        report_file = os.path.join(runs_path, '{0}_report.json'.format(date_str))
+        jsonio.dump(self.report(), report_file, indent=True)
+
+        return report_file
+
+class Progress(object):
+    """
+        Live single line progress display with throughput and ETA.
+    """
+
+    def __init__(self, total, stream=sys.stderr):
+        self.total = total
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.done = 0
+
+    def update(self, name):
+        self.done += 1
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else 0.0
+        line = '{0}/{1} {2:.2f} repos/s ETA {3:02d}:{4:02d} {5}'.format(
+            self.done, self.total, rate,
+            int(remaining // 60), int(remaining % 60), name
+        )
+        self.stream.write('\r' + line[:120].ljust(120))
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write('\n')
+        self.stream.flush()
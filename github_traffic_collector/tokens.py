@@ -0,0 +1,99 @@
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT = 5000
+
+class Token(object):
+
+    def __init__(self, value):
+        self.value = value
+        self.limit = DEFAULT_RATE_LIMIT
+        self.remaining = None
+        self.reset = None
+
+    def available(self, now):
+        """
+            Estimated number of requests this token can still make.
+        """
+        if self.remaining is None or (self.reset is not None and now >= self.reset):
+            return self.limit
+
+        return self.remaining
+
+    def __repr__(self):
+        return 'Token(...{0})'.format(self.value[-4:])
+
+class TokenPool(object):
+    """
+        Set of access tokens with rate limit budgets tracked from the
+        X-RateLimit response headers.
+
+        Each request uses the token with the largest remaining budget among
+        the tokens that can see the repository being requested.
+    """
+
+    def __init__(self, values):
+        if not values:
+            raise ValueError("At least one access token is required")
+
+        self.tokens = [Token(value) for value in values]
+        self.visibility = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        values = list(config.get('access_tokens', []))
+        if 'access_token' in config and config['access_token'] not in values:
+            values.insert(0, config['access_token'])
+
+        return cls(values)
+
+    def register_visibility(self, token, repo_names):
+        with self._lock:
+            for repo_name in repo_names:
+                tokens = self.visibility.setdefault(repo_name, [])
+                if token not in tokens:
+                    tokens.append(token)
+
+    def pick(self, repo_name=None):
+        """
+            Return the best token for a request, waiting for a rate limit
+            reset if every candidate token is exhausted.
+        """
+        while True:
+            with self._lock:
+                candidates = self.visibility.get(repo_name, self.tokens)
+                now = time.time()
+                token = max(candidates, key=lambda t: t.available(now))
+                if token.available(now) > 0:
+                    if token.remaining is not None and token.available(now) == token.remaining:
+                        # Reserve the request so concurrent callers spread out.
+                        token.remaining -= 1
+                    return token
+
+                wait = min(t.reset if t.reset is not None else now + 60 for t in candidates) - now
+
+            LOGGER.warning("All tokens exhausted, waiting %d seconds for rate limit reset", wait)
+            time.sleep(max(wait, 1))
+
+    def update(self, token, response):
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+
+        with self._lock:
+            token.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Limit' in headers:
+                token.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Reset' in headers:
+                token.reset = int(headers['X-RateLimit-Reset'])
+
+    def status(self):
+        now = time.time()
+        return [
+            {'token': repr(t), 'remaining': t.available(now), 'reset': t.reset}
+            for t in self.tokens
+        ]
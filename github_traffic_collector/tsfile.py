@@ -0,0 +1,100 @@
+"""
+    Zero-copy read path for PhilDB timeseries files.
+
+    PhilDB stores each timeseries as packed little endian records of
+    (int64 unix timestamp, float64 value, int32 metadata id). Mapping the
+    file read-only lets worker processes share its pages through the OS page
+    cache instead of each decoding a private copy.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+RECORD_DTYPE = np.dtype([('date', '<i8'), ('value', '<f8'), ('meta', '<i4')])
+
+# Metadata id PhilDB writes for missing values (phildb.constants).
+METADATA_MISSING_VALUE = 9999
+
+DAY = 24 * 60 * 60
+
+def map_records(path):
+    """
+        Memory map the records of a PhilDB timeseries file, returning an empty
+        record array for missing or empty files.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    if os.path.getsize(path) % RECORD_DTYPE.itemsize != 0:
+        raise ValueError("{0} is not a PhilDB timeseries file".format(path))
+
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+
+def read_mapped(path, start=None, end=None):
+    """
+        Read a PhilDB timeseries file as a pandas Series whose values are a
+        view onto the mapped file.
+
+        start and end (datetimes or date strings) restrict the result to a
+        window; only the pages holding that window are touched. Series with
+        missing values need a copy to replace PhilDB's missing value marker
+        with NaN.
+    """
+    records = map_records(path)
+    dates = records['date']
+
+    if start is not None or end is not None:
+        lo = 0 if start is None else np.searchsorted(dates, _timestamp(start), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, _timestamp(end), side='right')
+        records = records[lo:hi]
+        dates = records['date']
+
+    values = records['value']
+    missing = records['meta'] == METADATA_MISSING_VALUE
+    if missing.any():
+        values = np.where(missing, np.nan, values)
+
+    index = pd.DatetimeIndex(pd.to_datetime(dates, unit='s'), name='date')
+
+    return pd.Series(values, index=index, name='value', copy=False)
+
+def read_frame(paths, dtype=np.float64):
+    """
+        Read several PhilDB timeseries files into one daily DataFrame, a
+        column per (key, path) pair.
+
+        The values are copied out of each mapping into a single preallocated
+        array and the mapping is released before the next file is read, so
+        the result doesn't hold any files open.
+    """
+    keys = [key for key, path in paths]
+    first = None
+    last = None
+    for key, path in paths:
+        records = map_records(path)
+        if len(records) > 0:
+            first = records['date'][0] if first is None else min(first, records['date'][0])
+            last = records['date'][-1] if last is None else max(last, records['date'][-1])
+        del records
+
+    if first is None:
+        return pd.DataFrame(columns=keys, index=pd.DatetimeIndex([], name='date'), dtype=dtype)
+
+    first -= first % DAY
+    days = int((last - first) // DAY) + 1
+    values = np.full((days, len(keys)), np.nan, dtype=dtype)
+    for column, (key, path) in enumerate(paths):
+        records = map_records(path)
+        if len(records) > 0:
+            rows = (records['date'] - first) // DAY
+            missing = records['meta'] == METADATA_MISSING_VALUE
+            values[rows, column] = np.where(missing, np.nan, records['value'])
+        del records
+
+    index = pd.date_range(pd.to_datetime(first, unit='s'), periods=days, freq='D', name='date')
+
+    return pd.DataFrame(values, index=index, columns=keys, copy=False)
+
+def _timestamp(value):
+    return pd.Timestamp(value).value // 10 ** 9
@@ -30,7 +30,14 @@ setup(
     license='BSD',
     url='https://github.com/amacd31/github_traffic_collector',
     install_requires=requirements,
+    python_requires='>=3.8',
+    extras_require={
+        'fast': ['orjson'],
+        'zstd': ['zstandard'],
+        'brotli': ['brotli'],
+    },
     packages = ['github_traffic_collector'],
+    package_data = {'github_traffic_collector': ['templates/*.html']},
     test_suite = 'nose.collector',
     tests_require = ['nose'],
     entry_points = {
@@ -46,7 +53,10 @@ setup(
         'License :: OSI Approved :: BSD License',
 
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )
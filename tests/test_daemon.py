@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from github_traffic_collector.daemon import Schedule
+
+HOUR = 3600
+INTERVAL = 24 * HOUR
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.tmp_dir, 'daemon_state.json')
+        self.repo_names = ['user/repo_{0}'.format(i) for i in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_schedule(self, schedule, now, until):
+        """
+            Drive the schedule the way run_daemon does with a fake clock,
+            returning the (time, repository) collections made.
+        """
+        collections = []
+        while now < until:
+            due, repo_name = schedule.next_due(self.repo_names, now)
+            if due > now:
+                now = min(due, until)
+                continue
+            schedule.collected(repo_name, now)
+            collections.append((now, repo_name))
+
+        return collections
+
+    def test_new_repositories_collected_once_per_interval(self):
+        start = 1000 * INTERVAL + 5 * HOUR
+        schedule = Schedule(self.state_path, INTERVAL)
+        collections = self.run_schedule(schedule, start, start + 3 * INTERVAL)
+
+        self.assertEqual(len(collections), 3 * len(self.repo_names))
+        for repo_name in self.repo_names:
+            times = [when for when, name in collections if name == repo_name]
+            self.assertEqual(len(times), 3)
+            self.assertTrue(start <= times[0] < start + INTERVAL)
+            self.assertEqual(times[0] % INTERVAL, schedule.slot(repo_name))
+            self.assertEqual([b - a for a, b in zip(times, times[1:])], [INTERVAL, INTERVAL])
+
+    def test_first_seen_survives_restart(self):
+        start = 1000 * INTERVAL
+        schedule = Schedule(self.state_path, INTERVAL)
+        schedule.next_due(self.repo_names, start)
+        first_due = dict((name, schedule.due(name, start)) for name in self.repo_names)
+
+        restarted = Schedule(self.state_path, INTERVAL)
+        for name in self.repo_names:
+            self.assertEqual(restarted.due(name, start + 12 * HOUR), first_due[name])
+
+    def test_missed_repositories_due_on_restart(self):
+        start = 1000 * INTERVAL
+        schedule = Schedule(self.state_path, INTERVAL)
+        self.run_schedule(schedule, start, start + INTERVAL)
+
+        restarted = Schedule(self.state_path, INTERVAL)
+        now = start + 3 * INTERVAL
+        for name in self.repo_names:
+            self.assertTrue(restarted.due(name, now) <= now)